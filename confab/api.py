@@ -33,9 +33,13 @@ from confab.iter import (iter_hosts_and_roles,
                          make_conffiles,
                          this_hostname)
 
+# parallel execution
+from confab.parallel import run_in_parallel
+
 # fabric tasks
 from confab.diff import diff
 from confab.generate import generate
+from confab.impact import impact
 from confab.pull import pull
 from confab.push import push
 
@@ -51,6 +55,7 @@ __ignore__ = [
     remove_data_hook,
     diff,
     generate,
+    impact,
     pull,
     push,
     Options,
@@ -60,6 +65,7 @@ __ignore__ = [
     iter_conffiles,
     make_conffiles,
     this_hostname,
+    run_in_parallel,
     add_jinja_filter,
     remove_jinja_filter,
     JinjaFilters,
@@ -26,9 +26,13 @@ def _add_task(name, task, doc):
     commands[name] = runs_once(task_wrapper)
 
 
-def generate_tasks(settings_path=None):
+def generate_tasks(settings_path=None, snapshot=False):
     """
     Autogenerate `env` tasks for all defined environments.
+
+    :param settings_path: path to settings module (see :meth:`Settings.load_from_module`)
+    :param snapshot: whether to use a settings snapshot
+                     (see :meth:`Settings.load_from_snapshot`)
     """
     def create_task(settings, environment):
         def select_environment(*roles):
@@ -44,7 +48,7 @@ def generate_tasks(settings_path=None):
             env.environmentdef = settings.for_env(environment).with_roles(*roles)
         return select_environment
 
-    settings = Settings.load_from_module(settings_path)
+    settings = Settings.load_from_module(settings_path, snapshot=snapshot)
 
     for environment in settings.environmentdefs.iterkeys():
         _add_task(environment,
@@ -1,9 +1,11 @@
 """
 Configuration file template object model.
 """
+from cStringIO import StringIO
 from os.path import dirname, exists, join
 from hashlib import sha1
 from warnings import warn
+from weakref import WeakKeyDictionary
 from fabric.api import get, put, sudo
 from fabric.colors import blue, red, green, magenta
 from fabric.contrib.files import exists as exists_remote
@@ -11,39 +13,93 @@ from fabric.contrib.console import confirm
 from gusset.output import debug, status
 
 from confab.files import _clear_dir, _clear_file, _ensure_dir
+from confab.fingerprints import (digest_data, digest_file, digest_filters,
+                                 digest_shared_data, digest_template, load_fingerprints,
+                                 save_fingerprints)
 from confab.options import options
-from confab.validate import assert_may_be_created
+from confab.remote import digest_files, pull_files, push_files
+from confab.tracking import minimal_paths, track
+from confab.validate import assert_may_be_created, assert_unique_paths
 from confab.jinja_filters import jinja_filters
 
+import json
 import os
 import shutil
 
 
+# Compiled template name templates by Jinja environment and template name.
+_name_templates = WeakKeyDictionary()
+
+# Content shared between hosts by Jinja environment, template name and shared data
+# digest; ``False`` if the content depends on the host.
+_shared_contents = WeakKeyDictionary()
+
+# Data path of the current host.
+_HOST_PATH = ('confab', 'host')
+
+
+def _get_name_template(environment, template_name):
+    """
+    Return the compiled template for the (templated) name of a template.
+
+    Name templates are compiled once per environment.
+    """
+    name_templates = _name_templates.setdefault(environment, {})
+
+    name_template = name_templates.get(template_name)
+    if name_template is None:
+        name_template = name_templates[template_name] = environment.from_string(template_name)
+
+    return name_template
+
+
 class ConfFileDiff(object):
     """
     Encapsulation of the differences between the (locally copied) remote and
     generated versions of a configuration file.
     """
 
-    def __init__(self, remote_file_name, generated_file_name, conffile_name):
+    def __init__(self, remote_file_name, generated_file_name, conffile_name,
+                 generated_content=None):
         """
         Compute whether the conffile with the given name has changed given
         a remote and generate file copy.
+
+        If the ``generated_content`` is known, it is used instead of reading
+        the generated file.
         """
-        self.missing_generated = False
-        self.missing_remote = False
-        self.conffile_name = conffile_name
-        self.diff_lines = []
+        if generated_content is None and exists(generated_file_name):
+            with open(generated_file_name) as generated_file:
+                generated_content = generated_file.read()
 
-        if not exists(generated_file_name):
-            self.missing_generated = True
+        remote_content = None
+        if exists(remote_file_name):
+            with open(remote_file_name) as remote_file:
+                remote_content = remote_file.read()
 
-        if not exists(remote_file_name):
-            self.missing_remote = True
+        self._compare(remote_content, generated_content, conffile_name)
+
+    @classmethod
+    def from_content(cls, remote_content, generated_content, conffile_name):
+        """
+        Compute whether the conffile with the given name has changed given
+        the remote and generated content, without using any local files.
+
+        Missing files are represented by a content of ``None``.
+        """
+        diff = cls.__new__(cls)
+        diff._compare(remote_content, generated_content, conffile_name)
+        return diff
+
+    def _compare(self, remote_content, generated_content, conffile_name):
+        self.missing_generated = generated_content is None
+        self.missing_remote = remote_content is None
+        self.conffile_name = conffile_name
+        self.diff_lines = []
 
         if not self.missing_generated and not self.missing_remote:
-            diff_iter = options.diff(open(remote_file_name).readlines(),
-                                     open(generated_file_name).readlines(),
+            diff_iter = options.diff(StringIO(remote_content).readlines(),
+                                     StringIO(generated_content).readlines(),
                                      fromfile='{file_name} (remote)'.format(file_name=conffile_name),
                                      tofile='{file_name} (generated)'.format(file_name=conffile_name))
 
@@ -81,34 +137,119 @@ class ConfFileDiff(object):
 class ConfFile(object):
     """
     Encapsulation of a configuration file template.
+
+    Loading the template, rendering its name and detecting its mime type
+    are deferred until first needed.
+
+    The generated content is rendered at most once and shared by generation,
+    diffing and digests; assigning new ``data`` discards it (but modifying
+    ``data`` in place does not).
     """
 
-    def __init__(self, template, data, component):
-        self.template = template
-        self.data = data
+    def __init__(self, template, data, component, environment=None, shared_digest=None):
+        """
+        :param template: a Jinja2 template, or the name of a template in ``environment``.
+        :param data: template data.
+        :param component: an instance of :class:`confab.definitions.ComponentDefinition`
+        :param environment: the Jinja2 environment to load a named template from.
+        :param shared_digest: digest of ``data`` without the host (see
+            :func:`confab.fingerprints.digest_shared_data`); if given, content
+            that does not depend on the host is shared with other hosts.
+        """
+        if environment is None:
+            self._template = template
+            self._jinja_environment = template.environment
+            self.template_name = template.name
+        else:
+            self._template = None
+            self._jinja_environment = environment
+            self.template_name = template
+        self._filename = None
+        self._mime_type = None
+        self._name = None
+        self._content = None
+        self._data_keys = None
+        self._data = data
+        self._shared_digest = shared_digest
         self.host = component.host
         self.role = component.role
         self.component = component.name
         self.environment = component.environment
-        self.mime_type = options.get_mime_type(template.filename)
-        self.name = template.environment.from_string(template.name).render(**self.data)
-        self.remote = os.sep + self.name
+
+    @property
+    def data(self):
+        """
+        The template data.
+        """
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        self._name = None
+        self._content = None
+        self._data_keys = None
+        self._shared_digest = None
+
+    @property
+    def template(self):
+        """
+        The (compiled) Jinja2 template.
+        """
+        if self._template is None:
+            self._template = self._jinja_environment.get_template(self.template_name)
+        return self._template
+
+    @property
+    def filename(self):
+        """
+        The path of the template file.
+        """
+        if self._filename is None:
+            if self._template is not None:
+                self._filename = self._template.filename
+            else:
+                # obtain the path without compiling the template
+                _, self._filename, _ = self._jinja_environment.loader.get_source(
+                    self._jinja_environment, self.template_name)
+        return self._filename
+
+    @property
+    def mime_type(self):
+        if self._mime_type is None:
+            self._mime_type = options.get_mime_type(self.filename)
+        return self._mime_type
+
+    @property
+    def name(self):
+        """
+        The (rendered) path of the configuration file, relative to the root directory.
+        """
+        if self._name is None:
+            name_template = _get_name_template(self._jinja_environment, self.template_name)
+            self._name = name_template.render(**self.data)
+        return self._name
+
+    @property
+    def remote(self):
+        """
+        The absolute path of the configuration file on the remote host.
+        """
+        return os.sep + self.name
 
     def _write_verbatim(self, generated_file_name):
         """
         Write the configuration file without templating.
         """
-        shutil.copy2(self.template.filename, generated_file_name)
+        shutil.copy2(self.filename, generated_file_name)
 
     def _write_template(self, generated_file_name):
         """
         Write the configuration file as a template.
         """
-        with open(generated_file_name, 'w') as generated_file:
-            rendered = self.template.render(**self.data).encode('utf-8')
-            generated_file.write(rendered)
-            generated_file.write(u'\n')
-            shutil.copystat(self.template.filename, generated_file_name)
+        with open(generated_file_name, 'wb') as generated_file:
+            generated_file.write(self.content())
+        shutil.copystat(self.filename, generated_file_name)
 
     def diff(self, generated_dir, remotes_dir, output=False):
         """
@@ -124,7 +265,8 @@ class ConfFile(object):
 
         status('Computing diff for {file_name}', file_name=self.remote)
 
-        return ConfFileDiff(remote_file_name, generated_file_name, self.remote)
+        return ConfFileDiff(remote_file_name, generated_file_name, self.remote,
+                            self.content() if exists(generated_file_name) else None)
 
     def should_render(self):
         return options.should_render(self.mime_type)
@@ -132,16 +274,93 @@ class ConfFile(object):
     def is_empty(self):
         return options.is_empty(self.mime_type)
 
+    def content(self):
+        """
+        Return the content of the generated configuration file.
+        """
+        if self._content is None:
+            if self._shared_digest is not None and self.should_render():
+                self._content = self._shared_content()
+            elif self.should_render():
+                self._content = self.template.render(**self.data).encode('utf-8') + '\n'
+            else:
+                with open(self.filename, 'rb') as file_:
+                    self._content = file_.read()
+        return self._content
+
+    def _shared_content(self):
+        """
+        Return content rendered for any host with the same shared data digest,
+        rendering it if there is none.
+
+        The data keys the template reads are tracked for the first rendering;
+        content is only shared if the template does not read the host.
+        """
+        contents = _shared_contents.setdefault(self._jinja_environment, {})
+        key = (self.template_name, self._shared_digest)
+
+        content = contents.get(key)
+        if content is None or content is False:
+            content = self.template.render(**self.data).encode('utf-8') + '\n'
+            if key not in contents:
+                accessed = track(self.template, self.data)
+                if any(_HOST_PATH[:len(path)] == path for path in accessed):
+                    contents[key] = False
+                else:
+                    contents[key] = content
+        return content
+
+    def data_keys(self):
+        """
+        Return the paths of the data keys that the name and content of
+        this configuration file depend on.
+
+        Each path is a tuple of keys into ``data``; the empty tuple means
+        that all of the data is used. Paths below another path are omitted.
+
+        The keys are determined by rendering against a tracking view of the data
+        (see :mod:`confab.tracking`).
+        """
+        if self._data_keys is None:
+            name_template = _get_name_template(self._jinja_environment, self.template_name)
+            accessed = track(name_template, self.data)
+
+            if self.should_render():
+                # render normally first, so that template errors are raised
+                self.content()
+                accessed |= track(self.template, self.data)
+
+            self._data_keys = frozenset(minimal_paths(accessed))
+        return self._data_keys
+
     def hexdigest(self):
         """
         Return a hex digest of conffile content.
+
+        The digest matches the SHA-1 checksum of the generated file.
+        """
+        return sha1(self.content()).hexdigest()
+
+    def fingerprint(self, data_digest=None):
+        """
+        Return a fingerprint of the inputs of this configuration file
+        or ``None`` if they cannot be determined.
+
+        :param data_digest: precomputed digest of ``data`` (see
+                            :func:`confab.fingerprints.digest_data`)
         """
         if self.should_render():
-            content = self.template.render(**self.data).encode('utf-8')
+            template_digest = digest_template(self._jinja_environment, self.template_name)
+            if template_digest is None:
+                return None
         else:
-            with open(self.template.filename) as file_:
-                content = file_.read()
-        return sha1(content).hexdigest()
+            template_digest = sha1(self.content()).hexdigest()
+
+        inputs = [self.template_name,
+                  template_digest,
+                  data_digest or digest_data(self.data),
+                  digest_filters()]
+        return sha1(json.dumps(inputs)).hexdigest()
 
     def generate(self, directory):
         """
@@ -180,6 +399,25 @@ class ConfFile(object):
             status('Not found: {file_name}',
                    file_name=self.remote)
 
+    def store(self, directory, content):
+        """
+        Store content pulled from the remote host into a local file.
+
+        A content of ``None`` indicates that the remote file does not exist.
+        """
+        local_file_name = join(directory, self.name)
+        assert_may_be_created(local_file_name)
+
+        _clear_file(local_file_name)
+
+        if content is None:
+            status('Not found: {file_name}',
+                   file_name=self.remote)
+            return
+
+        with open(local_file_name, 'wb') as local_file:
+            local_file.write(content)
+
     def push(self, directory):
         """
         Push the generated configuration file to the remote host.
@@ -213,7 +451,9 @@ class ConfFiles(object):
         A set of templated configuration files.
 
         :param host_and_role: An instance of
-                              :class:`confab.definitions.HostAndRoleDefinition`
+                              :class:`confab.definitions.HostAndRoleDefinition`, or
+                              :class:`confab.definitions.HostDefinition` to cover
+                              all roles of a host
         :param environment_loader: An environment loader (e.g.
                                    :class:`confab.loaders.FileSystemEnvironmentLoader`)
         :param data_load: An instance DataLoader
@@ -227,7 +467,9 @@ class ConfFiles(object):
         self.conffiles = []
         self.host = host_and_role.host
         self.role = host_and_role.role
+        self.role_names = list(host_and_role.role_names)
         self.environment = host_and_role.environment
+        self._checked_paths = False
 
         # default base path for generated and remotes directories
         self.directory = host_and_role.environmentdef.directory or os.getcwd()
@@ -238,13 +480,16 @@ class ConfFiles(object):
             data = data_loader(component)
             environment = environment_loader(component.name)
             jinja_filters.register(environment)
+            shared_digest = digest_shared_data(data) if options.share_content else None
 
             for template_name in environment.list_templates(filter_func=options.filter_func):
                 debug("Adding template: {}".format(template_name))
 
-                self.conffiles.append(ConfFile(environment.get_template(template_name),
+                self.conffiles.append(ConfFile(template_name,
                                                data,
-                                               component))
+                                               component,
+                                               environment,
+                                               shared_digest))
 
         if not self.conffiles:
             warn("No conffiles found for '{role}' on '{host}' in environment '{environment}'"
@@ -252,6 +497,14 @@ class ConfFiles(object):
                          host=self.host,
                          environment=self.environment))
 
+    def _check_paths(self):
+        """
+        Check that the roles of a host do not generate the same files.
+        """
+        if not self._checked_paths and len(self.role_names) > 1:
+            assert_unique_paths(self.conffiles)
+        self._checked_paths = True
+
     def _get_host_generated_dir(self, directory):
         return join(directory or self.directory,
                     options.get_generated_dir(),
@@ -262,12 +515,167 @@ class ConfFiles(object):
                     options.get_remotes_dir(),
                     self.host)
 
+    def _pull(self, host_remotes_dir, conffiles=None):
+        """
+        Pull remote versions of files (by default, all files) into
+        ``host_remotes_dir`` in a single transfer.
+        """
+        conffiles = self.conffiles if conffiles is None else conffiles
+        if not conffiles:
+            return
+
+        status('Pulling {count} file(s) from {host}',
+               count=len(conffiles),
+               host=self.host)
+
+        contents = pull_files([conffile.remote for conffile in conffiles])
+
+        for conffile in conffiles:
+            conffile.store(host_remotes_dir, contents.get(conffile.remote))
+
+    def _pull_changed(self, host_remotes_dir, fetch=True):
+        """
+        Determine which files differ from their remote versions.
+
+        Unless disabled by the ``remote_digests`` option, remote and generated
+        digests are compared first and only files that differ are pulled (if
+        ``fetch`` is set); files that are known to be identical are copied into
+        ``host_remotes_dir`` from their generated content instead.
+
+        Returns the list of files that (may) differ.
+        """
+        if not options.remote_digests:
+            self._pull(host_remotes_dir)
+            return self.conffiles
+
+        changed, digests = self._compare_digests()
+
+        for conffile in self.conffiles:
+            if conffile.remote not in digests:
+                conffile.store(host_remotes_dir, None)
+            elif digests[conffile.remote] == conffile.hexdigest():
+                conffile.store(host_remotes_dir, conffile.content())
+
+        if fetch:
+            self._pull(host_remotes_dir,
+                       [conffile for conffile in changed if conffile.remote in digests])
+        else:
+            for conffile in changed:
+                _clear_file(join(host_remotes_dir, conffile.name))
+
+        return changed
+
+    def _push(self, host_generated_dir, conffiles):
+        """
+        Push generated versions of some files from ``host_generated_dir``
+        in a single transfer.
+        """
+        status('Pushing {count} file(s) to {host}',
+               count=len(conffiles),
+               host=self.host)
+
+        push_files([(join(host_generated_dir, conffile.name), conffile.remote)
+                    for conffile in conffiles])
+
+    def _compare_digests(self):
+        """
+        Compare the digests of all files with those of their remote versions.
+
+        Returns the list of files that differ (including files that do not exist
+        remotely) and the remote digests by path.
+        """
+        status('Comparing {count} file(s) with {host}',
+               count=len(self.conffiles),
+               host=self.host)
+
+        digests = digest_files([conffile.remote for conffile in self.conffiles])
+
+        changed = [conffile for conffile in self.conffiles
+                   if digests.get(conffile.remote) != conffile.hexdigest()]
+        return changed, digests
+
+    def _diff_in_memory(self):
+        """
+        Show diffs for all configuration files without writing any local files.
+        """
+        if options.remote_digests:
+            changed, digests = self._compare_digests()
+            to_pull = [conffile.remote for conffile in changed if conffile.remote in digests]
+        else:
+            changed = self.conffiles
+            to_pull = [conffile.remote for conffile in changed]
+
+        contents = pull_files(to_pull)
+
+        for conffile in changed:
+            ConfFileDiff.from_content(contents.get(conffile.remote),
+                                      conffile.content(),
+                                      conffile.remote).show()
+
+    def _get_host_fingerprints_file(self, directory):
+        return join(directory or self.directory,
+                    options.get_generated_dir(),
+                    '.fingerprints',
+                    self.host + '.json')
+
+    def _generate_incremental(self, directory, host_generated_dir):
+        """
+        Write configuration files whose fingerprints changed since they were
+        last generated and remove files these roles no longer generate.
+
+        Fingerprints are recorded per host, along with the role that generated
+        each file and a digest of the generated file, so that files modified
+        since (e.g. by a non-incremental run) are generated again.
+        """
+        fingerprints_file = self._get_host_fingerprints_file(directory)
+        fingerprints = load_fingerprints(fingerprints_file)
+
+        _ensure_dir(host_generated_dir)
+
+        data_digests = {}
+        names = set()
+        for conffile in self.conffiles:
+            if id(conffile.data) not in data_digests:
+                data_digests[id(conffile.data)] = digest_data(conffile.data)
+            fingerprint = conffile.fingerprint(data_digests[id(conffile.data)])
+
+            generated_file_name = join(host_generated_dir, conffile.name)
+            previous = fingerprints.get(conffile.name)
+
+            if (fingerprint is not None and previous is not None and
+                    previous['fingerprint'] == fingerprint and
+                    previous.get('digest') == digest_file(generated_file_name)):
+                debug("Unchanged: {}".format(conffile.remote))
+            else:
+                conffile.generate(host_generated_dir)
+
+            names.add(conffile.name)
+            fingerprints[conffile.name] = dict(role=conffile.role,
+                                               fingerprint=fingerprint,
+                                               digest=digest_file(generated_file_name))
+
+        for name, previous in fingerprints.items():
+            if previous['role'] in self.role_names and name not in names:
+                status('Removing {file_name}', file_name=os.sep + name)
+                _clear_file(join(host_generated_dir, name))
+                del fingerprints[name]
+
+        save_fingerprints(fingerprints_file, fingerprints)
+
     def generate(self, directory=None):
         """
         Write all configuration files to ``generated_dir``.
+
+        If the ``incremental`` option is set, only files whose inputs changed
+        are rewritten and only files that are no longer generated are removed.
         """
+        self._check_paths()
         host_generated_dir = self._get_host_generated_dir(directory)
 
+        if options.incremental:
+            self._generate_incremental(directory, host_generated_dir)
+            return
+
         _clear_dir(host_generated_dir)
         _ensure_dir(host_generated_dir)
 
@@ -278,42 +686,52 @@ class ConfFiles(object):
         """
         Pull remote versions of files into ``remotes_dir``.
         """
+        self._check_paths()
         host_remotes_dir = self._get_host_remotes_dir(directory)
 
-        for conffile in self.conffiles:
-            conffile.pull(host_remotes_dir)
+        self._pull(host_remotes_dir)
 
     def diff(self, directory=None):
         """
         Show diffs for all configuration files.
+
+        If the ``diff_in_memory`` option is set, neither generated nor
+        remote files are written.
         """
+        self._check_paths()
+        if options.diff_in_memory:
+            self._diff_in_memory()
+            return
+
         host_generated_dir = self._get_host_generated_dir(directory)
         host_remotes_dir = self._get_host_remotes_dir(directory)
 
-        for conffile in self.conffiles:
-            conffile.pull(host_remotes_dir)
+        changed = self._pull_changed(host_remotes_dir)
 
         for conffile in self.conffiles:
             conffile.generate(host_generated_dir)
 
-        for conffile in self.conffiles:
+        for conffile in changed:
             conffile.diff(host_generated_dir, host_remotes_dir).show()
 
     def push(self, directory=None):
         """
         Push configuration files that have changes, given user confirmation.
         """
+        self._check_paths()
         host_generated_dir = self._get_host_generated_dir(directory)
         host_remotes_dir = self._get_host_remotes_dir(directory)
 
-        for conffile in self.conffiles:
-            conffile.pull(host_remotes_dir)
+        changed = self._pull_changed(host_remotes_dir, fetch=False)
 
         for conffile in self.conffiles:
             conffile.generate(host_generated_dir)
 
-        has_diff = lambda conffile: conffile.diff(host_generated_dir, host_remotes_dir, True)
-        with_diffs = filter(has_diff, self.conffiles)
+        if options.remote_digests:
+            with_diffs = changed
+        else:
+            has_diff = lambda conffile: conffile.diff(host_generated_dir, host_remotes_dir, True)
+            with_diffs = filter(has_diff, changed)
 
         if not with_diffs:
             print(magenta('No configuration files to push for {host}'
@@ -329,5 +747,4 @@ class ConfFiles(object):
         if options.assume_yes or confirm('Push configuration files to {host}?'
                                          .format(host=self.host),
                                          default=False):
-            for conffile in with_diffs:
-                conffile.push(host_generated_dir)
+            self._push(host_generated_dir, with_diffs)
@@ -0,0 +1,158 @@
+"""
+Connections to remote :term:`hosts<host>`.
+
+Fabric opens a connection the first time a host is used and keeps it in its
+connection cache until it is disconnected. These functions cache each host's
+SSH configuration and open all connections of a run up front, optionally
+concurrently, so that the connections are ready for (and reused by) pull,
+diff and push.
+"""
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+from threading import local
+from time import time
+
+import fabric.network
+from fabric.api import env, settings
+from fabric.colors import red
+from fabric.network import connect, join_host_strings, normalize, ssh_config
+from fabric.state import connections
+from gusset.output import status
+
+
+# Parsed SSH configuration by host name and SSH config settings.
+_host_configs = {}
+
+# Host the current thread connects to.
+_thread_host = local()
+
+
+class ConnectionResult(object):
+    """
+    Outcome of connecting to a single host.
+    """
+
+    def __init__(self, host, seconds=None, error=None, reused=False):
+        self.host = host
+        self.seconds = seconds
+        self.error = error
+        self.reused = reused
+
+    def __nonzero__(self):
+        """
+        Evaluate to ``True`` if the host is connected.
+        """
+        return self.error is None
+
+
+def get_host_config(hostname):
+    """
+    Return the SSH configuration of a host (see :func:`fabric.network.ssh_config`).
+
+    The configuration is looked up once per host.
+    """
+    key = (hostname, env.use_ssh_config, env.ssh_config_path)
+    if key not in _host_configs:
+        _host_configs[key] = ssh_config(hostname)
+    return _host_configs[key]
+
+
+def _connection_key(hostname):
+    """
+    Return the user, host and port used to connect to a host, as well as
+    the key of the connection in Fabric's connection cache.
+    """
+    port = get_host_config(hostname).get("port", env.default_port)
+    with settings(host_string=hostname, port=port):
+        user, host, port = normalize(hostname)
+    return user, host, port, join_host_strings(user, host, port)
+
+
+def _thread_ssh_config(host_string=None):
+    """
+    Return the SSH configuration of a host, defaulting to the host the current
+    thread connects to (in place of :func:`fabric.network.ssh_config`).
+    """
+    return get_host_config(host_string or _thread_host.hostname)
+
+
+@contextmanager
+def _per_thread_hosts():
+    """
+    Context manager that makes Fabric use the SSH configuration (e.g. key files
+    and proxy commands) of each thread's host when connecting.
+
+    Fabric looks up the configuration of ``env.host_string``, which cannot
+    differ between threads.
+    """
+    fabric.network.ssh_config = _thread_ssh_config
+    try:
+        yield
+    finally:
+        fabric.network.ssh_config = ssh_config
+
+
+def _connect(args):
+    """
+    Open a connection to a host and add it to Fabric's connection cache.
+    """
+    hostname, (user, host, port, key) = args
+    if key in connections:
+        return ConnectionResult(hostname, reused=True)
+
+    _thread_host.hostname = hostname
+    start = time()
+    try:
+        connections[key] = connect(user, host, port, cache=connections)
+    except (Exception, SystemExit) as e:
+        # abort() has already written its own message
+        return ConnectionResult(hostname, error=str(e) or 'Aborted')
+    return ConnectionResult(hostname, seconds=time() - start)
+
+
+def _connect_to_host(args):
+    """
+    Open a connection to a host from the main thread.
+    """
+    hostname, (user, host, port, key) = args
+    with settings(host_string=hostname, port=port):
+        return _connect(args)
+
+
+def warm_up(hosts, jobs=1):
+    """
+    Connect to hosts before working on them, reporting how long each connection took.
+
+    :param hosts: host names.
+    :param jobs: maximum number of hosts to connect to concurrently; hosts that
+                 would prompt for a password fail when connecting concurrently.
+
+    Returns a list of :class:`ConnectionResult`, in host order.
+    """
+    # resolve connection settings up front, so that threads only read env
+    args = [(host, _connection_key(host)) for host in hosts]
+    if not args:
+        return []
+
+    if jobs > 1 and len(args) > 1:
+        # concurrent password prompts would interleave; fail those hosts instead
+        pool = ThreadPool(min(jobs, len(args)))
+        try:
+            with settings(abort_on_prompts=True), _per_thread_hosts():
+                results = pool.map(_connect, args)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        with _per_thread_hosts():
+            results = map(_connect_to_host, args)
+
+    for result in results:
+        if not result:
+            print(red('Unable to connect to {host}: {error}'.format(host=result.host,
+                                                                   error=result.error)))
+        elif not result.reused:
+            status('Connected to {host} in {seconds:.3f}s',
+                   host=result.host,
+                   seconds=result.seconds)
+    return results
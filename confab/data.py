@@ -1,15 +1,21 @@
 """
 Functions for loading configuration data.
 """
-from os.path import join
+import imp
+import json
+from hashlib import sha1
+from os import fdopen, listdir, remove, rename
+from os.path import exists, isdir, join, splitext
 from itertools import chain
+from tempfile import mkstemp
 
 from fabric.api import puts
 from gusset.output import debug
 from jinja2 import Environment, FileSystemLoader, TemplateNotFound
 
-from confab.files import _import, _import_string
-from confab.merge import merge
+from confab.files import _ensure_dir, _import, _import_string
+from confab.fingerprints import template_sources
+from confab.merge import LazyMerge, merge, _merge
 from confab.options import options
 from confab.hooks import hooks
 
@@ -21,10 +27,119 @@ class ModuleNotFound(Exception):
     pass
 
 
+# Jinja2 environments for data templates by data directory.
+_template_environments = {}
+
+# Loaded modules (or ModuleNotFound errors) by module name and data directory.
+_modules = {}
+
+# Names of the modules that may exist by data directory.
+_module_indexes = {}
+
+# File extensions of data modules.
+_MODULE_SUFFIXES = set(suffix for suffix, _, _ in imp.get_suffixes()) | set(['.py_tmpl'])
+
+
+def _get_module_index(data_dir):
+    """
+    Return the names of the modules that may be loaded from a data directory.
+
+    The directory is listed once; modules that are not in the index
+    do not exist and need not be looked for.
+    """
+    if data_dir not in _module_indexes:
+        names = set()
+        if isdir(data_dir):
+            for file_name in listdir(data_dir):
+                name, suffix = splitext(file_name)
+                if suffix in _MODULE_SUFFIXES:
+                    names.add(name)
+                elif not suffix and isdir(join(data_dir, file_name)):
+                    # package
+                    names.add(file_name)
+        _module_indexes[data_dir] = frozenset(names)
+    return _module_indexes[data_dir]
+
+
+def _get_template_environment(data_dir):
+    """
+    Return the Jinja2 environment for data templates in a data directory.
+    """
+    if data_dir not in _template_environments:
+        _template_environments[data_dir] = Environment(loader=FileSystemLoader(data_dir))
+    return _template_environments[data_dir]
+
+
+def _render_module(module_name, data_dir):
+    """
+    Render a ``.py_tmpl`` data module.
+
+    If a cache directory is configured, rendered modules are stored there
+    keyed on the sources of the template and any templates it references.
+
+    Raises TemplateNotFound if there is no such template.
+    """
+    env = _get_template_environment(data_dir)
+    template_name = module_name + '.py_tmpl'
+
+    cache_file_name = None
+    cache_dir = options.get_cache_dir()
+    if cache_dir:
+        sources = template_sources(env, template_name)
+        if sources is not None:
+            cache_file_name = join(cache_dir, 'data',
+                                   sha1(json.dumps(sources)).hexdigest() + '.py')
+            if exists(cache_file_name):
+                with open(cache_file_name) as cache_file:
+                    return cache_file.read().decode('utf-8')
+
+    rendered_module = env.get_template(template_name).render({})
+
+    if cache_file_name:
+        _ensure_dir(join(cache_dir, 'data'))
+        # write to a temporary file and rename it into place, so that
+        # concurrent runs never read a partially written module
+        handle, tmp_file_name = mkstemp(dir=join(cache_dir, 'data'), suffix='.tmp')
+        try:
+            with fdopen(handle, 'w') as cache_file:
+                cache_file.write(rendered_module.encode('utf-8'))
+            rename(tmp_file_name, cache_file_name)
+        except:
+            remove(tmp_file_name)
+            raise
+
+    return rendered_module
+
+
 def _import_configuration(module_name, data_dir):
     """
     Load configuration from file as python module.
 
+    Modules are loaded once per data directory; modules that could not
+    be found are remembered as well and modules that are not in the data
+    directory's index are not looked for at all.
+
+    :param data_dir: directory to load from.
+    """
+    if '/' not in module_name and module_name not in _get_module_index(data_dir):
+        raise ModuleNotFound("No module named {}".format(module_name))
+
+    key = (module_name, data_dir)
+    if key not in _modules:
+        try:
+            _modules[key] = _load_configuration(module_name, data_dir)
+        except ModuleNotFound as e:
+            _modules[key] = e
+
+    if isinstance(_modules[key], ModuleNotFound):
+        raise _modules[key]
+    return _modules[key]
+
+
+def _load_configuration(module_name, data_dir):
+    """
+    Load configuration from file as python module.
+
     :param data_dir: directory to load from.
     """
     try:
@@ -44,8 +159,7 @@ def _import_configuration(module_name, data_dir):
               data_dir=data_dir)
         # try to load as a template
         try:
-            env = Environment(loader=FileSystemLoader(data_dir))
-            rendered_module = env.get_template(module_name + '.py_tmpl').render({})
+            rendered_module = _render_module(module_name, data_dir)
             module = _import_string(module_name, rendered_module)
             puts("Loaded {module_name}.py_tmpl from {data_dir}".format(module_name=module_name,
                                                                        data_dir=data_dir))
@@ -58,6 +172,38 @@ def _import_configuration(module_name, data_dir):
     return module
 
 
+def _add_scope(data_dirs, scope):
+    """
+    Return the directories to load a module of a scope from, in order of precedence.
+    """
+    if scope is None:
+        return data_dirs
+    return list(chain(*zip(data_dirs, map(lambda data_dir: join(data_dir, scope), data_dirs))))
+
+
+def module_files(module_name, data_dirs, scope=None):
+    """
+    Return the files a data module may be loaded from.
+
+    Includes locations that do not exist (yet), since adding a data module
+    changes the data as well, and the templates that data templates include.
+
+    :param data_dirs: list of directories to load from.
+    :param scope: containing folder name for module.
+    """
+    file_names = []
+    for data_dir in _add_scope(data_dirs, scope):
+        template_name = module_name + '.py_tmpl'
+        file_names.extend([join(data_dir, module_name + '.py'),
+                           join(data_dir, module_name),
+                           join(data_dir, template_name)])
+
+        if exists(join(data_dir, template_name)):
+            sources = template_sources(_get_template_environment(data_dir), template_name)
+            file_names.extend(join(data_dir, name) for name, _ in sources or ())
+    return file_names
+
+
 def import_configuration(module_name, *data_dirs, **kwargs):
     """
     Load configuration from a python module as a dictionary.
@@ -65,12 +211,7 @@ def import_configuration(module_name, *data_dirs, **kwargs):
     :param data_dirs: List of directories to load from.
     :param scope: (kwargs) Containing folder name for module.
     """
-    def add_scope(data_dirs, scope):
-        if scope is None:
-            return data_dirs
-        return list(chain(*zip(data_dirs, map(lambda data_dir: join(data_dir, scope), data_dirs))))
-
-    for data_dir in add_scope(data_dirs, kwargs.get('scope')):
+    for data_dir in _add_scope(data_dirs, kwargs.get('scope')):
         try:
             module = _import_configuration(module_name, data_dir)
             return options.module_as_dict(module)
@@ -81,6 +222,14 @@ def import_configuration(module_name, *data_dirs, **kwargs):
     return options.module_as_dict({})
 
 
+def _has_callables(data):
+    """
+    Return whether data contains callables (custom merge values).
+    """
+    return any(callable(value) or (isinstance(value, dict) and _has_callables(value))
+               for value in data.itervalues())
+
+
 class DataLoader(object):
     """
     Load and merge configuration data.
@@ -91,20 +240,35 @@ class DataLoader(object):
 
     Configuration data also includes the current environment
     and host string values under a ``confab`` key.
+
+    Merged data is memoized by scope prefix: components that share the same
+    ``default``, ``component``, ``role``, ... modules (and hooks) reuse the
+    merge of that prefix and only merge the remaining modules. Merges that
+    involve callables (which may depend on the current host) are repeated
+    for every component.
+
+    Data can also be returned as a :class:`confab.merge.LazyMerge` view that
+    only merges the values templates access.
     """
 
     ALL = ['default', 'component', 'role', 'environment', 'host']
 
-    def __init__(self, data_dirs, data_modules=ALL, ignore_hooks=False):
+    def __init__(self, data_dirs, data_modules=ALL, ignore_hooks=False, lazy=None):
         """
         Create a data loader for the given data directories.
 
         :param data_dirs: list of data directories or a single data directory path.
         :param data_modules: list of modules to load in the order to load them.
+        :param lazy: whether to return lazily merged data; defaults to the
+            ``lazy_data`` option.
         """
         self.data_dirs = data_dirs if isinstance(data_dirs, list) else [data_dirs]
         self.data_modules = set(data_modules)
         self._ignore_hooks = ignore_hooks
+        self._lazy = lazy
+        # (merged data or None if not merged (or not reusable), loaded data,
+        # whether the loaded data is free of callables) by scope prefix
+        self._prefixes = {}
 
     def __call__(self, componentdef):
         """
@@ -112,21 +276,69 @@ class DataLoader(object):
 
         :param component: a component definition.
         """
-        def load_modules():
-            for scope, module_name in self._list_modules(componentdef):
-                yield import_configuration(module_name, *self.data_dirs, scope=scope)
-
-                if not self._ignore_hooks:
-                    for hook in hooks.for_scope(scope):
-                        if hook.filter(componentdef):
-                            yield hook(module_name)
-
         confab_data = dict(confab=dict(environment=componentdef.environment,
                                        host=componentdef.host,
                                        role=componentdef.role,
                                        component=componentdef.name))
 
-        return merge(confab_data, *load_modules())
+        lazy = options.lazy_data if self._lazy is None else self._lazy
+
+        merged, loaded = self._load(componentdef, lazy)
+
+        if lazy:
+            return LazyMerge(confab_data, *loaded)
+
+        if any('confab' in data for data in loaded):
+            # data overrides confab values; merge it the long way
+            return merge(confab_data, *loaded)
+
+        # equivalent to merge(confab_data, *loaded)
+        merged = dict(merged)
+        merged.update(confab_data)
+        return merged
+
+    def _load(self, componentdef, lazy=False):
+        """
+        Load and merge the data modules (and hooks) for a component.
+
+        Returns the merged data (``None`` if ``lazy``) and the list of loaded
+        data dictionaries.
+        """
+        merged, loaded = {}, []
+        prefix = ()
+        # whether the merge of the prefix so far can be reused
+        static = True
+
+        for scope, module_name in self._list_modules(componentdef):
+            if self._ignore_hooks:
+                scope_hooks = ()
+            else:
+                scope_hooks = tuple(hook for hook in hooks.for_scope(scope)
+                                    if hook.filter(componentdef))
+
+            prefix += ((scope, module_name, scope_hooks),)
+            if prefix not in self._prefixes:
+                data = [import_configuration(module_name, *self.data_dirs, scope=scope)]
+                data.extend(hook(module_name) for hook in scope_hooks)
+                self._prefixes[prefix] = (None, loaded + data, not any(map(_has_callables, data)))
+
+            prefix_merged, prefix_loaded, prefix_static = self._prefixes[prefix]
+            static = static and prefix_static
+            if prefix_merged is None and not lazy:
+                prefix_merged = reduce(_merge, prefix_loaded[len(loaded):], merged)
+                if static:
+                    self._prefixes[prefix] = (prefix_merged, prefix_loaded, prefix_static)
+
+            merged, loaded = prefix_merged, prefix_loaded
+
+        return merged, loaded
+
+    def list_modules(self, componentdef):
+        """
+        Return the (scope, module name) pairs to load for a component,
+        in order of increasing precedence.
+        """
+        return self._list_modules(componentdef)
 
     def _list_modules(self, componentdef):
         """
@@ -1,12 +1,19 @@
 """
 Representation of and iteration through defined hosts, environments, and roles.
 """
-from warnings import warn
+from hashlib import sha1
+from tempfile import mkstemp
+from warnings import catch_warnings, simplefilter, warn
 from confab.files import _import
 
+import cPickle
 import os
 
 
+# Version of the settings snapshot format.
+SNAPSHOT_VERSION = 1
+
+
 class Settings(object):
     """
     Collection of :term:`environment`, :term:`role`, and :term:`component` definitions.
@@ -39,18 +46,74 @@ class Settings(object):
 
     def __init__(self, directory=None):
         self.directory = directory
+        # incremented whenever definitions are assigned
+        self._version = 0
         self.environmentdefs = {}
         self.roledefs = {}
         self.componentdefs = {}
 
+    def _changed(self):
+        """
+        Discard everything computed from the definitions.
+        """
+        self._version += 1
+        self._host_roles = None
+        self._components = {}
+        self._valid_environments = set()
+
+    @property
+    def environmentdefs(self):
+        """
+        The :term:`environment` to :term:`hosts<host>` mapping.
+        """
+        return self._environmentdefs
+
+    @environmentdefs.setter
+    def environmentdefs(self, environmentdefs):
+        self._environmentdefs = environmentdefs
+        self._changed()
+
+    @property
+    def roledefs(self):
+        """
+        The :term:`role` to :term:`hosts<host>` mapping.
+
+        Assigning new role definitions rebuilds the host to roles index;
+        modify role definitions by assigning them rather than in place.
+        """
+        return self._roledefs
+
+    @roledefs.setter
+    def roledefs(self, roledefs):
+        self._roledefs = roledefs
+        self._changed()
+
+    @property
+    def componentdefs(self):
+        """
+        The :term:`role` (or :term:`component`) to :term:`components<component>` mapping.
+
+        Component expansions are computed once per role; modify component
+        definitions by assigning them rather than in place.
+        """
+        return self._componentdefs
+
+    @componentdefs.setter
+    def componentdefs(self, componentdefs):
+        self._componentdefs = componentdefs
+        self._changed()
+
     @classmethod
-    def load_from_module(cls, settings_path=None):
+    def load_from_module(cls, settings_path=None, snapshot=False):
         """
         Load settings from a Python module.
 
         :param settings_path: path to settings module. a full path or directory name.
                               module name defaults to ``settings``. directory defaults
                               to the current working directory.
+        :param snapshot: whether to load the settings from (and save them to) a
+                         validated snapshot next to the settings module; see
+                         :meth:`load_from_snapshot`.
         """
         if settings_path:
             if settings_path.endswith(".py"):
@@ -61,6 +124,12 @@ class Settings(object):
         else:
             dir_name, module_name = os.getcwd(), None
 
+        if snapshot:
+            settings_ = cls.load_from_snapshot(os.path.join(dir_name,
+                                                            (module_name or "settings") + ".py"))
+            if settings_ is not None:
+                return settings_
+
         settings_ = Settings(dir_name)
         try:
             module = _import(module_name or 'settings', dir_name)
@@ -71,8 +140,88 @@ class Settings(object):
 
         for key in Settings.KEYS:
             setattr(settings_, key, getattr(module, key, {}))
+        settings_.validate()
+
+        if snapshot:
+            settings_.save_snapshot(os.path.join(dir_name, (module_name or "settings") + ".py"))
         return settings_
 
+    @classmethod
+    def load_from_snapshot(cls, module_path):
+        """
+        Load settings from the snapshot of a settings module.
+
+        Snapshots contain the definitions and everything derived from them
+        (see :meth:`save_snapshot`) and are only used while the settings
+        module is unchanged. Note that changes to modules imported by the
+        settings module are not detected.
+
+        :param module_path: path of the settings module.
+
+        Returns ``None`` if there is no current snapshot.
+        """
+        try:
+            with open(_snapshot_path(module_path), 'rb') as snapshot_file:
+                snapshot = cPickle.load(snapshot_file)
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            return None
+
+        digest = _digest_file(module_path)
+        if digest is None or snapshot.get('version') != SNAPSHOT_VERSION or \
+                snapshot.get('digest') != digest:
+            return None
+
+        settings = Settings(os.path.dirname(module_path))
+        for key in Settings.KEYS:
+            setattr(settings, key, snapshot[key])
+        settings._host_roles = snapshot['host_roles']
+        settings._components = snapshot['components']
+        settings._valid_environments = snapshot['valid_environments']
+        return settings
+
+    def save_snapshot(self, module_path):
+        """
+        Save a validated snapshot of these settings next to their settings module.
+
+        Besides the definitions, the snapshot contains the host to roles index,
+        the components of every role and the environments whose hosts all have roles.
+
+        :param module_path: path of the settings module.
+        """
+        self.validate()
+        with catch_warnings():
+            simplefilter('ignore')
+            for environment in self.environmentdefs:
+                try:
+                    self.for_env(environment)
+                except Exception:
+                    # reported when the environment is selected
+                    pass
+
+        snapshot = dict(version=SNAPSHOT_VERSION,
+                        digest=_digest_file(module_path),
+                        host_roles=self._host_roles,
+                        components=self._components,
+                        valid_environments=self._valid_environments)
+        for key in Settings.KEYS:
+            snapshot[key] = getattr(self, key)
+
+        # write to a temporary file and rename it into place, so that
+        # concurrent runs never read a partially written snapshot
+        snapshot_path = _snapshot_path(module_path)
+        try:
+            handle, tmp_path = mkstemp(dir=os.path.dirname(snapshot_path), suffix='.tmp')
+        except OSError as e:
+            warn("Unable to save settings snapshot: {}".format(e))
+            return
+        try:
+            with os.fdopen(handle, 'wb') as snapshot_file:
+                cPickle.dump(snapshot, snapshot_file, cPickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, snapshot_path)
+        except (IOError, OSError, cPickle.PicklingError, TypeError) as e:
+            os.remove(tmp_path)
+            warn("Unable to save settings snapshot: {}".format(e))
+
     @classmethod
     def load_from_dict(cls, dct):
         """
@@ -81,8 +230,19 @@ class Settings(object):
         settings = Settings()
         for key in Settings.KEYS:
             setattr(settings, key, dct.get(key, {}))
+        settings.validate()
         return settings
 
+    def validate(self):
+        """
+        Expand the :term:`components<component>` of every :term:`role`.
+
+        Raises an exception if component definitions contain a cycle or
+        reach a component along multiple paths.
+        """
+        for role in self.roledefs:
+            self._components_for_role(role)
+
     def for_env(self, environment):
         """
         Obtain a specific :term:`environment` definition.
@@ -95,9 +255,11 @@ class Settings(object):
             raise KeyError("Environment '{}' is not defined".format(environment))
         if not self.environmentdefs[environment]:
             warn("Environment '{}' does not have any hosts defined.".format(environment))
-        for host in self.environmentdefs[environment]:
-            if not self._roles_for_host(host):
-                raise Exception("Host '{}' does not have any configured roles".format(host))
+        if environment not in self._valid_environments:
+            for host in self.environmentdefs[environment]:
+                if not self._roles_for_host(host):
+                    raise Exception("Host '{}' does not have any configured roles".format(host))
+            self._valid_environments.add(environment)
         return EnvironmentDefinition(self, environment)
 
     def all(self):
@@ -111,7 +273,62 @@ class Settings(object):
         """
         Compute complete list of roles for a host.
         """
-        return [role for (role, hosts) in self.roledefs.iteritems() if host in hosts]
+        if self._host_roles is None:
+            # index roles by host once instead of scanning every role for each host
+            self._host_roles = {}
+            for role, hosts in self.roledefs.iteritems():
+                for host_ in hosts:
+                    roles = self._host_roles.setdefault(host_, [])
+                    if not roles or roles[-1] != role:
+                        roles.append(role)
+        return list(self._host_roles.get(host, []))
+
+    def _components_for_role(self, role):
+        """
+        Compute (once) the list of components of a role.
+
+        If a role has no components, it has a single component named after the role.
+        """
+        if role not in self._components:
+            self._components[role] = self._expand_components(role, '', {})
+        return self._components[role]
+
+    def _expand_components(self, component, path, seen):
+        component_path = os.path.join(path, component)
+
+        if component in seen:
+            raise Exception("Detected cycle or multiple paths with role/component '{}'"
+                            " ('{}' and '{}')".format(component,
+                                                      seen[component],
+                                                      component_path))
+        seen[component] = component_path
+
+        if component not in self.componentdefs:
+            return [component]
+
+        components = []
+        for c in self.componentdefs.get(component):
+            components += self._expand_components(c, component_path, seen)
+
+        return components
+
+
+def _snapshot_path(module_path):
+    """
+    Return the path of the snapshot of a settings module.
+    """
+    return os.path.splitext(module_path)[0] + '.snapshot'
+
+
+def _digest_file(file_name):
+    """
+    Return the digest of a file, or ``None`` if it cannot be read.
+    """
+    try:
+        with open(file_name, 'rb') as file_:
+            return sha1(file_.read()).hexdigest()
+    except IOError:
+        return None
 
 
 class EnvironmentDefinition(object):
@@ -132,6 +349,10 @@ class EnvironmentDefinition(object):
         self.name = name
         self.selected_hosts = selected_hosts or []
         self.selected_roles = selected_roles or []
+        # (settings version, host to roles mapping)
+        self._host_roles = (None, None)
+        # (settings version, definitions by host or host and role)
+        self._definitions = (None, None)
 
     @property
     def directory(self):
@@ -144,8 +365,14 @@ class EnvironmentDefinition(object):
     def host_roles(self):
         """
         Return the :term:`host` to :term:`roles<role>` mapping.
+
+        The mapping is computed once (until the settings change).
         """
-        return self._resolve_host_roles()
+        version, host_roles = self._host_roles
+        if version != self.settings._version:
+            host_roles = self._resolve_host_roles()
+            self._host_roles = (self.settings._version, host_roles)
+        return host_roles
 
     def with_hosts(self, *hosts):
         """
@@ -186,14 +413,14 @@ class EnvironmentDefinition(object):
         """
         for host, roles in self.host_roles.iteritems():
             for role in roles:
-                yield HostAndRoleDefinition(self, host, role)
+                yield self._host_and_role(host, role)
 
     def hosts(self):
         """
         Iterate through all valid hosts.
         """
         for host, roles in self.host_roles.iteritems():
-            yield HostDefinition(self, host, roles)
+            yield self._intern(host, lambda: HostDefinition(self, host, roles))
 
     def components(self):
         """
@@ -204,6 +431,26 @@ class EnvironmentDefinition(object):
             for component in host_and_role.components():
                 yield component
 
+    def _intern(self, key, create):
+        """
+        Return the (shared) definition for a key, creating it if needed.
+
+        Definitions are created once per environment definition (until the
+        settings change) and reused across iterations.
+        """
+        version, definitions = self._definitions
+        if version != self.settings._version:
+            definitions = {}
+            self._definitions = (self.settings._version, definitions)
+
+        definition = definitions.get(key)
+        if definition is None:
+            definition = definitions[key] = create()
+        return definition
+
+    def _host_and_role(self, host, role):
+        return self._intern((host, role), lambda: HostAndRoleDefinition(self, host, role))
+
     def _resolve_host_roles(self):
         """
         Compute the most appropriate mapping from host to roles.
@@ -225,32 +472,56 @@ class EnvironmentDefinition(object):
         return host_roles
 
 
-class HostDefinition(object):
+class _Definition(object):
+    """
+    Base class for immutable definitions that compare and hash by value.
+    """
+
+    __slots__ = ()
+
+    def _key(self):
+        return tuple(self)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return str(tuple(self))
+
+
+class HostDefinition(_Definition):
     """
     A host in the context of a specific environment.
     """
 
+    __slots__ = ('environmentdef', 'environment', 'host', 'role_names', 'role')
+
     def __init__(self, environmentdef, host, roles):
         """
         Constructor should not be called directly.
         """
         self.environmentdef = environmentdef
+        self.environment = environmentdef.name
         self.host = host
         self.role_names = roles
+        # all roles, for display
+        self.role = ','.join(roles)
 
     def __iter__(self):
         return iter([self.environment, self.host, self.role_names])
 
-    def __repr__(self):
-        return str((self.environment, self.host, self.role_names))
-
-    @property
-    def environment(self):
-        return self.environmentdef.name
+    def _key(self):
+        return (self.environment, self.host, tuple(self.role_names))
 
     def roles(self):
         for role in self.role_names:
-            yield HostAndRoleDefinition(self.environmentdef, self.host, role)
+            yield self.environmentdef._host_and_role(self.host, role)
 
     def components(self):
         for host_and_role in self.roles():
@@ -258,87 +529,62 @@ class HostDefinition(object):
                 yield component
 
 
-class HostAndRoleDefinition(object):
+class HostAndRoleDefinition(_Definition):
     """
     A :term:`host` and :term:`role` in the context of a specific
     :term:`environment`.
     """
 
+    __slots__ = ('environmentdef', 'environment', 'host', 'role', '_components')
+
     def __init__(self, environmentdef, host, role):
         """
         Constructor should not be called directly.
         """
         self.environmentdef = environmentdef
+        self.environment = environmentdef.name
         self.host = host
         self.role = role
+        # (settings version, component definitions)
+        self._components = (None, None)
 
     def __iter__(self):
         return iter([self.environment, self.host, self.role])
 
-    def __repr__(self):
-        return str((self.environment, self.host, self.role))
-
     @property
-    def environment(self):
-        return self.environmentdef.name
+    def role_names(self):
+        return [self.role]
 
     def components(self):
         # If a role has no components, will generate a component named after the role
-        for component in self._expand_components(self.role, '', {}):
-            yield ComponentDefinition(self, component)
-
-    def _expand_components(self, component, path, seen):
-        component_path = os.path.join(path, component)
-
-        if component in seen:
-            raise Exception("Detected cycle or multiple paths with role/component '{}'"
-                            " ('{}' and '{}')".format(component,
-                                                      seen[component],
-                                                      component_path))
-        seen[component] = component_path
+        settings = self.environmentdef.settings
+        version, components = self._components
+        if version != settings._version:
+            components = tuple(ComponentDefinition(self, component)
+                               for component in settings._components_for_role(self.role))
+            self._components = (settings._version, components)
+        return iter(components)
 
-        if component not in self.environmentdef.settings.componentdefs:
-            return [component]
-
-        components = []
-        for c in self.environmentdef.settings.componentdefs.get(component):
-            components += self._expand_components(c, component_path, seen)
 
-        return components
-
-
-class ComponentDefinition(object):
+class ComponentDefinition(_Definition):
     """
     A component in the context of a specific :term:`host` and :term:`role`.
     """
 
+    __slots__ = ('host_and_role', 'environment', 'host', 'role', 'name')
+
     def __init__(self, host_and_role, name):
         """
         Constructor should not be called directly.
         """
         self.host_and_role = host_and_role
+        self.environment = host_and_role.environment
+        self.host = host_and_role.host
+        self.role = host_and_role.role
         self.name = name
 
-    @property
-    def environment(self):
-        return self.host_and_role.environment
-
-    @property
-    def host(self):
-        return self.host_and_role.host
-
-    @property
-    def role(self):
-        return self.host_and_role.role
-
     def __iter__(self):
         return iter([self.environment,
                      self.host,
                      self.role,
                      self.name])
-
-    def __repr__(self):
-        return str((self.environment,
-                    self.host,
-                    self.role,
-                    self.name))
@@ -10,6 +10,8 @@ from gusset.output import configure_output
 from confab.definitions import Settings
 from confab.iter import iter_conffiles
 from confab.main import add_core_options
+from confab.options import Options
+from confab.tracking import format_path
 
 
 def parse_options():
@@ -18,29 +20,40 @@ def parse_options():
     """
     parser = OptionParser(usage="confab-show [options]")
     add_core_options(parser)
+    parser.add_option('-k', '--keys',
+                      dest='keys',
+                      action='store_true',
+                      default=False,
+                      help='Show the data keys each configuration file depends on')
 
     opts, args = parser.parse_args()
     return parser, opts, args
 
 
-def make_row(conffile):
+def make_row(conffile, keys=False):
     """
     Generate a dictionary describing this conffile.
     """
-    return {
+    row = {}
+    if keys:
+        # render with key tracking before hashing reuses the content
+        row["keys"] = ", ".join(sorted(format_path(path) for path in conffile.data_keys()))
+    row.update({
         "hash": conffile.hexdigest(),
         "environment": conffile.environment,
         "host": conffile.host,
         "path": conffile.remote,
         "role": conffile.role,
         "component": conffile.component,
-    }
+    })
+    return row
 
 
 def make_table(settings_,
                environment,
                hosts,
-               roles):
+               roles,
+               keys=False):
     """
     Transform command line arguments into a table.
     """
@@ -49,13 +62,10 @@ def make_table(settings_,
                                     description["path"],
                                     description["role"],
                                     description["component"])
-    table = ColorTable("hash",
-                       "environment",
-                       "host",
-                       "path",
-                       "role",
-                       "component",
-                       sort_key=sort_key)
+    columns = ["hash", "environment", "host", "path", "role", "component"]
+    if keys:
+        columns.append("keys")
+    table = ColorTable(*columns, sort_key=sort_key)
 
     for environmentdef in settings_.all():
         # match environment, if any
@@ -68,7 +78,7 @@ def make_table(settings_,
         with settings(environmentdef=environmentdef):
             for conffiles in iter_conffiles(settings_.directory):
                 for conffile in conffiles.conffiles:
-                    row = make_row(conffile)
+                    row = make_row(conffile, keys)
                     table.add(**row)
     return table
 
@@ -83,13 +93,15 @@ def main():
 
         configure_output(verbosity=options.verbosity, quiet=options.quiet)
 
-        settings = Settings.load_from_module(options.directory)
+        settings = Settings.load_from_module(options.directory, snapshot=options.snapshot)
 
     except Exception as e:
         parser.error(e)
 
-    table = make_table(settings,
-                       options.environment,
-                       options.hosts.split(",") if options.hosts else [],
-                       options.roles.split(",") if options.roles else [])
+    with Options(get_cache_dir=lambda: options.cache_dir):
+        table = make_table(settings,
+                           options.environment,
+                           options.hosts.split(",") if options.hosts else [],
+                           options.roles.split(",") if options.roles else [],
+                           options.keys)
     print(table)
@@ -0,0 +1,163 @@
+"""
+Fingerprints of the inputs of generated configuration files.
+
+A fingerprint combines the template source (including any templates it
+references), the template data and the registered Jinja filters. If the
+fingerprint of a configuration file is unchanged, so is its generated
+content, which allows generation to skip files whose inputs did not change.
+"""
+import json
+from collections import Mapping
+from hashlib import sha1
+from os.path import dirname, exists
+from weakref import WeakKeyDictionary
+
+from jinja2 import meta
+
+from confab.files import _ensure_dir
+from confab.jinja_filters import jinja_filters
+
+
+# Template sources, their digest and up-to-date checks by Jinja environment
+# and template name.
+_template_sources = WeakKeyDictionary()
+
+
+def _json_default(value):
+    """
+    Serialize values that JSON does not support natively.
+    """
+    if isinstance(value, Mapping):
+        return dict(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    # best effort; values whose representation varies between runs
+    # merely cause files to be regenerated
+    return repr(value)
+
+
+def digest_data(data):
+    """
+    Return a digest of template data.
+    """
+    return sha1(json.dumps(data, sort_keys=True, default=_json_default)).hexdigest()
+
+
+def digest_shared_data(data):
+    """
+    Return a digest of template data without the current host.
+
+    Hosts whose data only differs by host name have the same digest.
+    """
+    shared = dict(data)
+    if isinstance(shared.get('confab'), Mapping):
+        shared['confab'] = dict(shared['confab'], host=None)
+    return digest_data(shared)
+
+
+def digest_filters():
+    """
+    Return a digest of the registered Jinja filters.
+    """
+    names = sorted('{}.{}'.format(filter.__module__, filter.__name__)
+                   for filter in jinja_filters.filters.itervalues())
+    return sha1('\n'.join(names)).hexdigest()
+
+
+def _find_template_sources(environment, template_name):
+    """
+    Load and parse a template and all templates it references.
+
+    Returns the (name, source) pairs (or ``None``) and the up-to-date checks
+    of the loaded templates.
+    """
+    sources = []
+    uptodates = []
+    pending = [template_name]
+    seen = set()
+
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+
+        source, _, uptodate = environment.loader.get_source(environment, name)
+        sources.append((name, source))
+        uptodates.append(uptodate)
+
+        for reference in meta.find_referenced_templates(environment.parse(source)):
+            if reference is None:
+                return None, uptodates
+            pending.append(reference)
+
+    return tuple(sources), uptodates
+
+
+def _get_template_sources(environment, template_name):
+    """
+    Return the cached (sources, digest, up-to-date checks) entry of a template.
+
+    Templates are parsed once per environment until one of their sources changes.
+    """
+    entries = _template_sources.setdefault(environment, {})
+
+    entry = entries.get(template_name)
+    if entry is None or not all(uptodate() for uptodate in entry[2] if uptodate is not None):
+        sources, uptodates = _find_template_sources(environment, template_name)
+        digest = None if sources is None else sha1(json.dumps(sources)).hexdigest()
+        entry = entries[template_name] = (sources, digest, uptodates)
+
+    return entry
+
+
+def template_sources(environment, template_name):
+    """
+    Return the sources of a template and all templates it references
+    (via include, import or extends) as a tuple of (name, source) pairs.
+
+    Returns ``None`` if a referenced template cannot be determined statically.
+    """
+    return _get_template_sources(environment, template_name)[0]
+
+
+def digest_template(environment, template_name):
+    """
+    Return a digest of the sources of a template and all templates it references.
+
+    Returns ``None`` if a referenced template cannot be determined statically.
+    """
+    return _get_template_sources(environment, template_name)[1]
+
+
+def digest_file(file_name):
+    """
+    Return a digest of the content of a file, or ``None`` if it does not exist.
+    """
+    if not exists(file_name):
+        return None
+    with open(file_name, 'rb') as file_:
+        return sha1(file_.read()).hexdigest()
+
+
+def load_fingerprints(file_name):
+    """
+    Load previously saved fingerprints.
+    """
+    if not exists(file_name):
+        return {}
+    try:
+        with open(file_name) as file_:
+            return json.load(file_)
+    except ValueError:
+        # corrupt; regenerate everything
+        return {}
+
+
+def save_fingerprints(file_name, fingerprints):
+    """
+    Save fingerprints.
+    """
+    _ensure_dir(dirname(file_name))
+    with open(file_name, 'w') as file_:
+        json.dump(fingerprints, file_, sort_keys=True, indent=1)
@@ -0,0 +1,144 @@
+"""
+Impact analysis: which :term:`hosts<host>` and configuration files depend on a file.
+
+The dependency index maps template and data files to the configuration files
+(by host, :term:`component` and template name) that use them. It is built
+from the settings, the template listings and the data module names alone,
+without loading data or rendering templates.
+"""
+from collections import defaultdict
+from os.path import realpath, sep
+
+from fabric.api import task
+from gusset.colortable import ColorTable
+
+from confab.conffiles import ConfFile
+from confab.data import module_files
+from confab.fingerprints import template_sources
+from confab.iter import get_environmentdef, get_loaders
+from confab.options import options
+
+
+class ImpactIndex(object):
+    """
+    Index from files to the configuration files that depend on them.
+    """
+
+    def __init__(self):
+        # (host, component, template name) by real file path
+        self._dependents = defaultdict(set)
+        # real file paths by file path
+        self._real_paths = {}
+
+    def _real_path(self, file_name):
+        if file_name not in self._real_paths:
+            self._real_paths[file_name] = realpath(file_name)
+        return self._real_paths[file_name]
+
+    def add(self, file_name, componentdef, template_name):
+        """
+        Record that a configuration file of a component depends on a file.
+        """
+        self._dependents[self._real_path(file_name)].add((componentdef.host,
+                                                          componentdef.name,
+                                                          template_name))
+
+    def impact(self, path):
+        """
+        Return the sorted (host, component, template name) tuples that
+        depend on a file, or on any file below a directory.
+        """
+        path = realpath(path)
+        dependents = set()
+        for file_name, file_dependents in self._dependents.iteritems():
+            if file_name == path or file_name.startswith(path + sep) or \
+                    path.startswith(file_name + sep):
+                dependents.update(file_dependents)
+        return sorted(dependents)
+
+
+def _template_files(conffile, environment):
+    """
+    Return the files a configuration file's template consists of.
+    """
+    if not conffile.should_render():
+        return [conffile.filename]
+
+    sources = template_sources(environment, conffile.template_name)
+    if sources is None:
+        # references cannot be determined statically; assume any template
+        names = environment.list_templates(filter_func=options.filter_func)
+    else:
+        names = [name for name, _ in sources]
+    return [environment.loader.get_source(environment, name)[1] for name in names]
+
+
+def _component_templates(environment, componentdef):
+    """
+    Return (template name, files) pairs for the templates of a component.
+    """
+    return [(template_name,
+             _template_files(ConfFile(template_name, {}, componentdef, environment), environment))
+            for template_name in environment.list_templates(filter_func=options.filter_func)]
+
+
+def build_impact_index(environmentdef, directory=None):
+    """
+    Build the dependency index of the configuration files in an environment.
+
+    Template dependencies only depend on the component and data module
+    dependencies only on the module, so each is determined once and then
+    recorded for every host that uses it.
+
+    :param environmentdef: an instance of :class:`confab.definitions.EnvironmentDefinition`
+    :param directory: path to templates and data directories.
+    """
+    environment_loader, data_loader = get_loaders(directory)
+    index = ImpactIndex()
+
+    # (template name, files) pairs by component name
+    component_templates = {}
+    # files by (scope, module name)
+    data_files = {}
+
+    for componentdef in environmentdef.components():
+        if componentdef.name not in component_templates:
+            component_templates[componentdef.name] = _component_templates(
+                environment_loader(componentdef.name), componentdef)
+        templates = component_templates[componentdef.name]
+
+        for template_name, file_names in templates:
+            for file_name in file_names:
+                index.add(file_name, componentdef, template_name)
+
+        for scope, module_name in data_loader.list_modules(componentdef):
+            if (scope, module_name) not in data_files:
+                data_files[scope, module_name] = module_files(module_name,
+                                                              data_loader.data_dirs,
+                                                              scope)
+            for file_name in data_files[scope, module_name]:
+                for template_name, _ in templates:
+                    index.add(file_name, componentdef, template_name)
+
+    return index
+
+
+@task
+def impact(*paths, **kwargs):
+    """
+    Show the hosts and configuration files that depend on files or directories.
+
+    :param directory: (kwargs) path to templates and data directories.
+    """
+    index = build_impact_index(get_environmentdef(), kwargs.get('directory'))
+
+    table = ColorTable("path",
+                       "host",
+                       "component",
+                       "template",
+                       sort_key=lambda row: (row["path"], row["host"],
+                                             row["component"], row["template"]))
+    for path in paths:
+        for host, component, template_name in index.impact(path):
+            table.add(path=path, host=host, component=component, template=template_name)
+    print(table)
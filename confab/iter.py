@@ -8,8 +8,7 @@ from os.path import join
 from pkg_resources import iter_entry_points
 from warnings import warn
 
-from fabric.network import ssh_config
-
+from confab.connections import get_host_config
 from confab.options import options
 from confab.validate import assert_exists
 from confab.loaders import FileSystemEnvironmentLoader
@@ -17,6 +16,13 @@ from confab.data import DataLoader
 from confab.conffiles import ConfFiles
 
 
+# Environment loaders by templates directories and bytecode cache directory.
+_environment_loaders = {}
+
+# Data loaders by data directories.
+_data_loaders = {}
+
+
 @contextmanager
 def this_hostname(hostname):
     """
@@ -24,7 +30,7 @@ def this_hostname(hostname):
 
     Updates hostname and port.
     """
-    host_config = ssh_config(hostname)
+    host_config = get_host_config(hostname)
 
     host_string = hostname
     port = host_config.get("port", env.default_port)
@@ -34,7 +40,7 @@ def this_hostname(hostname):
         yield
 
 
-def _get_environmentdef():
+def get_environmentdef():
     """
     Retreive the EnvironmentDefinition from the fabric env.
     """
@@ -51,11 +57,15 @@ def _get_environmentdef():
     return environmentdef
 
 
+# former name
+_get_environmentdef = get_environmentdef
+
+
 def iter_hosts():
     """
     Iterate over all hosts in the configured environment.
     """
-    environmentdef = _get_environmentdef()
+    environmentdef = get_environmentdef()
 
     for host in environmentdef.hosts():
         # fabric needs the host if we're calling from main()
@@ -67,7 +77,7 @@ def iter_hosts_and_roles():
     """
     Iterate over all hosts and roles in the configured environment.
     """
-    environmentdef = _get_environmentdef()
+    environmentdef = get_environmentdef()
 
     for host_and_role in environmentdef.all():
         # fabric needs the host if we're calling from main()
@@ -80,11 +90,19 @@ def iter_conffiles(directory=None):
     Generate :class:`~confab.conffiles.ConfFiles` objects for each
     ``host_and_role`` in an :term:`environment`.
 
+    If the ``group_by_host`` option is set, generate one object per :term:`host`
+    instead, covering the configuration files of all of its roles.
+
     Uses the default :class:`~confab.loaders.FileSystemEnvironmentLoader` and
     :class:`~confab.data.DataLoader`.
 
     :param directory: Path to templates and data directories.
     """
+    if options.group_by_host:
+        for host in iter_hosts():
+            yield make_conffiles(host, directory)
+        return
+
     for host_and_role in iter_hosts_and_roles():
         yield make_conffiles(host_and_role, directory)
 
@@ -92,11 +110,22 @@ def iter_conffiles(directory=None):
 def make_conffiles(host_and_role, directory=None):
     """
     Create a :class:`~confab.conffiles.ConfFiles` object for a
-    ``host_and_role`` in an :term:`environment`.
+    ``host_and_role`` (or a host with all of its roles) in an :term:`environment`.
 
     Uses the default :class:`~confab.loaders.FileSystemEnvironmentLoader` and
     :class:`~confab.data.DataLoader`.
 
+    :param directory: Path to templates and data directories.
+    """
+    environment_loader, data_loader = get_loaders(directory)
+    return ConfFiles(host_and_role, environment_loader, data_loader)
+
+
+def get_loaders(directory=None):
+    """
+    Return the default (shared) :class:`~confab.loaders.FileSystemEnvironmentLoader`
+    and :class:`~confab.data.DataLoader` for a directory and any extension paths.
+
     :param directory: Path to templates and data directories.
     """
     directories = [directory or options.get_base_dir()]
@@ -108,9 +137,20 @@ def make_conffiles(host_and_role, directory=None):
     data_dirs = map(lambda dir: join(dir, options.get_data_dir()), directories)
     assert_exists(*data_dirs)
 
-    return ConfFiles(host_and_role,
-                     FileSystemEnvironmentLoader(*templates_dirs),
-                     DataLoader(data_dirs))
+    cache_dir = options.get_cache_dir()
+    bytecode_cache_dir = join(cache_dir, 'templates') if cache_dir else None
+
+    # share environments (and their compiled templates) across hosts
+    key = (tuple(templates_dirs), bytecode_cache_dir)
+    if key not in _environment_loaders:
+        _environment_loaders[key] = FileSystemEnvironmentLoader(
+            *templates_dirs, bytecode_cache_dir=bytecode_cache_dir)
+
+    # share loaded and merged data across hosts
+    if tuple(data_dirs) not in _data_loaders:
+        _data_loaders[tuple(data_dirs)] = DataLoader(data_dirs)
+
+    return _environment_loaders[key], _data_loaders[tuple(data_dirs)]
 
 
 def iter_extension_paths():
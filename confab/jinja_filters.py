@@ -1,6 +1,10 @@
 """
 Allows custom jinja filters.
 """
+from collections import Mapping
+from weakref import WeakKeyDictionary
+
+from jinja2.defaults import DEFAULT_FILTERS
 
 ### Built-in filters ###
 
@@ -13,7 +17,7 @@ def select(value, key):
     the ``value`` is returned as is.
     """
 
-    return value.get(key, value) if isinstance(value, dict) else value
+    return value.get(key, value) if isinstance(value, Mapping) else value
 
 
 def rotate(list_, pivot):
@@ -60,15 +64,22 @@ class JinjaFiltersRegistry(object):
     """
     def __init__(self):
         self._filters = set(built_in_filters())
+        # incremented whenever the set of filters changes
+        self._version = 0
+        # version and filter names last registered on each environment
+        self._registered = WeakKeyDictionary()
 
     def add_filter(self, filter):
-        self._filters.add(filter)
+        if filter not in self._filters:
+            self._filters.add(filter)
+            self._version += 1
 
     def remove_filter(self, filter):
         try:
             self._filters.remove(filter)
         except KeyError:
             return False
+        self._version += 1
         return True
 
     @property
@@ -78,10 +89,25 @@ class JinjaFiltersRegistry(object):
     def register(self, environment):
         """
         Register filters on a Jinja environment object.
+
+        Environments are shared, so filters are only (re-)registered if they
+        changed since the last registration on the same environment.
         """
-        for name, filter in self.filters.iteritems():
+        version, registered_names = self._registered.get(environment, (None, ()))
+        if version == self._version:
+            return
+
+        filters = self.filters
+        for name in registered_names:
+            if name in DEFAULT_FILTERS:
+                environment.filters[name] = DEFAULT_FILTERS[name]
+            elif name not in filters:
+                environment.filters.pop(name, None)
+        for name, filter in filters.iteritems():
             environment.filters[name] = filter
 
+        self._registered[environment] = (self._version, filters.keys())
+
 
 class JinjaFilters(object):
     """
@@ -5,21 +5,99 @@ Confab uses the environments :meth:`jinja2.Environment.list_templates` method
 to abstract template location from rendering and synchronization.
 
 Note that the default Jinja2 Loaders assume a charset (default: utf-8).
+
+Environments are created once per template sub-directory and reused for
+the lifetime of their loader, so that each template is only compiled once
+no matter how many hosts use it.
+
+Loaders may also be given a ``bytecode_cache_dir``, in which case compiled
+templates are stored on disk and reused by later (and concurrent) runs until
+the template source changes.
 """
-from jinja2 import (Environment, FileSystemLoader, PackageLoader, BaseLoader,
-                    StrictUndefined, TemplateNotFound)
+from jinja2 import (Environment, FileSystemBytecodeCache, FileSystemLoader, PackageLoader,
+                    BaseLoader, StrictUndefined, TemplateNotFound)
+from os import fdopen, remove, rename
 from os.path import join, exists
 from pkg_resources import get_provider
+from tempfile import mkstemp
 from gusset.output import debug
 
+from confab.files import _ensure_dir
+
+
+class AtomicFileSystemBytecodeCache(FileSystemBytecodeCache):
+    """
+    Bytecode cache that is safe to share between concurrent runs.
+
+    Cache files are written to a temporary file and renamed into place, and
+    unreadable (e.g. truncated) cache files are treated as cache misses.
+    """
 
-class FileSystemEnvironmentLoader(object):
+    def load_bytecode(self, bucket):
+        try:
+            super(AtomicFileSystemBytecodeCache, self).load_bytecode(bucket)
+        except Exception:
+            debug("Ignoring unreadable bytecode cache for {}".format(bucket.key))
+            bucket.reset()
+
+    def dump_bytecode(self, bucket):
+        handle, tmp_file_name = mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with fdopen(handle, 'wb') as cache_file:
+                bucket.write_bytecode(cache_file)
+            rename(tmp_file_name, self._get_cache_filename(bucket))
+        except:
+            remove(tmp_file_name)
+            raise
+
+
+class EnvironmentLoader(object):
+    """Base class for loaders that memoize Jinja2 environments by sub-directory."""
+
+    def __init__(self, bytecode_cache_dir=None):
+        self._environments = {}
+        self.bytecode_cache = None
+        if bytecode_cache_dir:
+            _ensure_dir(bytecode_cache_dir)
+            self.bytecode_cache = AtomicFileSystemBytecodeCache(bytecode_cache_dir)
+
+    def __call__(self, subdir):
+        """
+        Return the Jinja2 Environment for a template sub-directory.
+        """
+        environment = self._environments.get(subdir)
+        if environment is None:
+            environment = self._environments[subdir] = self.load(subdir)
+        return environment
+
+    def load(self, subdir):
+        """
+        Create a Jinja2 Environment for a template sub-directory.
+        """
+        raise NotImplementedError
+
+    def _make_environment(self, loader):
+        """
+        Create a Jinja2 Environment that keeps all of its compiled templates.
+        """
+        return Environment(loader=loader,
+                           undefined=StrictUndefined,
+                           cache_size=-1,
+                           bytecode_cache=self.bytecode_cache)
+
+
+class FileSystemEnvironmentLoader(EnvironmentLoader):
     """Loads Jinja2 environments from directories."""
 
-    def __init__(self, *directories):
+    def __init__(self, *directories, **kwargs):
+        """
+        :param directories: template directories, in order of precedence.
+        :param bytecode_cache_dir: (kwargs) optional directory for compiled templates.
+        """
+        super(FileSystemEnvironmentLoader, self).__init__(kwargs.get('bytecode_cache_dir'))
         self.directories = directories
 
-    def __call__(self, subdir):
+    def load(self, subdir):
         """
         Load a Jinja2 Environment for a template sub-directory.
         """
@@ -31,18 +109,18 @@ class FileSystemEnvironmentLoader(object):
             return Environment(loader=EmptyLoader())
 
         debug("Creating ConfabFileSystemLoader for {}".format(template_path))
-        return Environment(loader=ConfabFileSystemLoader(template_path),
-                           undefined=StrictUndefined)
+        return self._make_environment(ConfabFileSystemLoader(template_path))
 
 
-class PackageEnvironmentLoader(object):
+class PackageEnvironmentLoader(EnvironmentLoader):
     """Loads Jinja2 environments from python packages."""
 
-    def __init__(self, package_name, templates_path='templates'):
+    def __init__(self, package_name, templates_path='templates', bytecode_cache_dir=None):
+        super(PackageEnvironmentLoader, self).__init__(bytecode_cache_dir)
         self.package_name = package_name
         self.templates_path = templates_path
 
-    def __call__(self, subdir):
+    def load(self, subdir):
         """
         Load a Jinja2 Environment for a template sub-directory.
         """
@@ -54,8 +132,7 @@ class PackageEnvironmentLoader(object):
             return Environment(loader=EmptyLoader())
 
         debug("Creating PackageLoader for {}".format(package_path))
-        return Environment(loader=PackageLoader(self.package_name, package_path),
-                           undefined=StrictUndefined)
+        return self._make_environment(PackageLoader(self.package_name, package_path))
 
 
 class ConfabFileSystemLoader(FileSystemLoader):
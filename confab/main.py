@@ -20,16 +20,21 @@ from fabric.api import env, settings
 from fabric.network import disconnect_all
 from gusset.output import configure_output
 
+from confab.connections import warm_up
 from confab.definitions import Settings
 from confab.diff import diff
 from confab.generate import generate
+from confab.impact import impact
+from confab.iter import get_environmentdef
 from confab.options import Options
+from confab.parallel import run_in_parallel
 from confab.pull import pull
 from confab.push import push
 
 
 _tasks = {"diff":     (diff,     True,  True),
           "generate": (generate, True,  False),
+          "impact":   (impact,   True,  False),
           "pull":     (pull,     False, True),
           "push":     (push,     True,  True)}
 
@@ -42,7 +47,7 @@ def parse_options():
     working directory.
     """
 
-    usage = "confab [options] {tasks}".format(tasks="|".join(_tasks.keys()))
+    usage = "confab [options] {tasks} [paths]".format(tasks="|".join(_tasks.keys()))
     parser = OptionParser(usage=usage)
 
     add_core_options(parser)
@@ -61,6 +66,40 @@ def parse_options():
                       action="store_true",
                       help="cause Fabric to load your local SSH config file")
 
+    parser.add_option("-m", "--in-memory", dest="diff_in_memory",
+                      action="store_true",
+                      default=False,
+                      help="compute diffs without writing generated and remote files")
+
+    parser.add_option("-i", "--incremental", dest="incremental",
+                      action="store_true",
+                      default=False,
+                      help="only regenerate configuration files whose inputs changed")
+
+    parser.add_option("-g", "--group-by-host", dest="group_by_host",
+                      action="store_true",
+                      default=False,
+                      help="handle the configuration files of all roles of a host together")
+
+    parser.add_option("-S", "--share-content", dest="share_content",
+                      action="store_true",
+                      default=False,
+                      help="render files that do not depend on the host once for all"
+                      " hosts with the same data")
+
+    parser.add_option("-j", "--jobs", dest="jobs",
+                      type="int",
+                      default=1,
+                      help="number of hosts to operate on concurrently [default: %default]")
+
+    parser.add_option("-w", "--warm-up", dest="warm_up",
+                      type="int",
+                      default=0,
+                      metavar="JOBS",
+                      help="connect to all hosts before starting, JOBS hosts at a time,"
+                      " and show how long each connection took (with -j, each host is"
+                      " connected to by its worker and JOBS only needs to be positive)")
+
     opts, args = parser.parse_args()
     return parser, opts, args
 
@@ -73,6 +112,10 @@ def add_core_options(parser):
                       default=getcwd(),
                       help="directory from which to load configuration [default: %default]")
 
+    parser.add_option("-c", "--cache-dir", dest="cache_dir",
+                      default=None,
+                      help="directory in which to cache compiled templates between runs")
+
     parser.add_option("-e", "--environment", dest="environment",
                       default="local",
                       help="environment to operate on [default: %default]")
@@ -81,6 +124,12 @@ def add_core_options(parser):
                       default="",
                       help="comma-separated list of hosts to operate on")
 
+    parser.add_option("-s", "--snapshot", dest="snapshot",
+                      action="store_true",
+                      default=False,
+                      help="load settings from a snapshot saved next to the settings module"
+                      " while the module is unchanged")
+
     parser.add_option("-q", "--quiet", dest="quiet",
                       action="store_true",
                       default=False,
@@ -100,7 +149,8 @@ def add_core_options(parser):
 def load_environmentdef(environment,
                         settings_path=None,
                         hosts=None,
-                        roles=None):
+                        roles=None,
+                        snapshot=False):
     """
     Load settings, construct an environment definition, and save in Fabric env
     as ``confab`` for use by subsequent confab tasks.
@@ -109,9 +159,10 @@ def load_environmentdef(environment,
     :param settings_path: path to settings module
     :param hosts: comma delimited host list
     :param roles: comma delimited role list
+    :param snapshot: whether to use a settings snapshot
     """
 
-    settings_ = Settings.load_from_module(settings_path)
+    settings_ = Settings.load_from_module(settings_path, snapshot=snapshot)
 
     # Normalize and resolve hosts to roles mapping
     selected_hosts = hosts.split(",") if hosts else []
@@ -154,16 +205,42 @@ def main():
             load_environmentdef(environment=options.environment,
                                 settings_path=options.directory,
                                 hosts=options.hosts,
-                                roles=options.roles)
+                                roles=options.roles,
+                                snapshot=options.snapshot)
         except Exception as e:
             parser.error(e)
 
         task_func = get_task(parser, options, arguments)
 
+        if task_func is impact and len(arguments) < 2:
+            parser.error("Please specify the paths to show the impact of")
+
+        needs_connections = options.warm_up > 0 and _tasks[arguments[0]][2]
+
+        if options.jobs > 1 and task_func is push and not options.assume_yes:
+            parser.error("Pushing to multiple hosts concurrently requires --yes")
+
         with settings(user=options.user,
                       use_ssh_config=options.use_ssh_config):
-            with Options(assume_yes=options.assume_yes):
-                task_func(options.directory)
+            with Options(assume_yes=options.assume_yes,
+                         diff_in_memory=options.diff_in_memory,
+                         incremental=options.incremental,
+                         share_content=options.share_content,
+                         group_by_host=options.group_by_host,
+                         get_cache_dir=lambda: options.cache_dir):
+                if task_func is impact:
+                    impact(*arguments[1:], directory=options.directory)
+                elif options.jobs > 1:
+                    # connections do not survive forking; each worker warms up its own host
+                    if not all(run_in_parallel(task_func, options.directory, options.jobs,
+                                               warm_up=needs_connections)):
+                        sys.exit(1)
+                else:
+                    if needs_connections:
+                        hosts = [hostdef.host for hostdef in get_environmentdef().hosts()]
+                        if not all(warm_up(hosts, options.warm_up)):
+                            sys.exit(1)
+                    task_func(options.directory)
 
     except SystemExit:
         raise
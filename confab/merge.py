@@ -17,7 +17,14 @@ For example, a list of hosts in the ``default`` dictionary will normally
 be replaced by values defined in the override dictionary; however if
 the override dictionary's list is a callable, it can be made to do
 something else, such as append a new host to the default list.
+
+Merged dictionaries share unchanged values with their inputs, so merged
+data should be treated as read-only.
+
+:class:`LazyMerge` provides the same result as a view that only merges
+the values that are actually accessed.
 """
+from collections import Mapping
 
 
 def _best(default_value, has_override, override_value):
@@ -37,33 +44,83 @@ def _best(default_value, has_override, override_value):
         return override_value
 
 
-def _iterkeys(default, override):
+def _merge(default, override):
     """
-    Return an iterator over the keys of the both dicts.
+    Recursively merge two dictionaries.
+
+    Only the keys of ``override`` are visited. Values of ``default`` that
+    are not overridden (including nested dictionaries) are shared with the
+    result rather than copied, and if ``override`` does not change anything,
+    ``default`` itself is returned.
     """
-    return iter(set(default.keys()) | set(override.keys()))
+    merged = None
+    for key, override_value in override.iteritems():
+        default_value = default.get(key)
+        value = _best(default_value, True, override_value)
+        if value is default_value and key in default:
+            # unchanged
+            continue
+        if merged is None:
+            merged = dict(default)
+        merged[key] = value
+    return default if merged is None else merged
 
 
-def _entry(default, override, key):
+def merge(*args):
     """
-    Return a dictionary entry with the best value from the ``default`` and
-    ``override`` dictionaries.
+    Recursively merge multiple dictionaries.
     """
-    return key, _best(default.get(key), key in override, override.get(key))
+    return reduce(_merge, args, {})
 
 
-def _merge(default, override):
+class LazyMerge(Mapping):
     """
-    Recursively merge two dictionaries.
+    Read-only view of multiple dictionaries merged into the first.
+
+    Each key is merged on first access (and then remembered) using the
+    same rules as :func:`merge`, so data under keys that are never accessed
+    is never merged. Values are merged completely: nested dictionaries are
+    plain ``dict`` objects, as with :func:`merge`.
     """
-    return dict(_entry(default, override, key) for key in _iterkeys(default, override))
 
+    def __init__(self, *layers):
+        self._layers = layers
+        self._values = {}
+        self._keys = None
 
-def merge(*args):
-    """
-    Recursively merge multiple dictionaries.
-    """
-    return reduce(_merge, args, {})
+    def __getitem__(self, key):
+        if key not in self._values:
+            self._values[key] = self._resolve(key)
+        return self._values[key]
+
+    def __contains__(self, key):
+        return any(key in layer for layer in self._layers)
+
+    def __iter__(self):
+        if self._keys is None:
+            self._keys = set()
+            for layer in self._layers:
+                self._keys.update(layer.iterkeys())
+        return iter(self._keys)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return 'LazyMerge({!r})'.format(dict(self))
+
+    def _resolve(self, key):
+        """
+        Merge the values of a key.
+        """
+        values = [layer[key] for layer in self._layers if key in layer]
+        if not values:
+            raise KeyError(key)
+
+        value = None
+        for override_value in values:
+            value = _best(value, True, override_value)
+        return value
 
 
 class Append(list):
@@ -2,7 +2,7 @@
 Options for managing Confab.
 """
 
-from os import getcwd
+from os import getcwd, stat
 from os.path import basename
 from fabric.api import env, task
 from fabric.utils import _AttributeDict
@@ -58,13 +58,32 @@ def _filter_func(file_name):
     return _is_not_temporary(file_name) and _is_not_internal(file_name)
 
 
+# Shared libmagic handle; loading the magic database is expensive.
+_magic = None
+
+# Detected mime types by file name, modification time and size.
+_mime_types = {}
+
+
 def _get_mime_type(file_name):
     """
     Return the mime type of a file.
 
     The mime_type will be used to determine if a configuration file is text.
+
+    Each file is only examined once unless it is modified.
     """
-    return Magic(mime=True).from_file(file_name)
+    global _magic
+
+    stat_ = stat(file_name)
+    key = (file_name, stat_.st_mtime, stat_.st_size)
+
+    mime_type = _mime_types.get(key)
+    if mime_type is None:
+        if _magic is None:
+            _magic = Magic(mime=True)
+        mime_type = _mime_types[key] = _magic.from_file(file_name)
+    return mime_type
 
 
 def _diff(a, b, fromfile=None, tofile=None):
@@ -117,6 +136,24 @@ options = _AttributeDict({
     # How to determine diffs?
     'diff': _diff,
 
+    # Should remote changes be detected by comparing digests before pulling?
+    'remote_digests': True,
+
+    # Should diffs be computed without writing generated and remote files?
+    'diff_in_memory': False,
+
+    # Should generation only rewrite files whose inputs changed?
+    'incremental': False,
+
+    # Should data be merged lazily as templates access it?
+    'lazy_data': False,
+
+    # Should the configuration files of all roles of a host be handled together?
+    'group_by_host': False,
+
+    # Should content that does not depend on the host be rendered once and shared?
+    'share_content': False,
+
     # How to get dictionary configuration from module data?
     'module_as_dict': _as_dict,
 
@@ -134,6 +171,9 @@ options = _AttributeDict({
 
     # What is the name of the remotes directory?
     'get_remotes_dir': lambda: 'remotes',
+
+    # Where to keep caches between runs (if anywhere)?
+    'get_cache_dir': lambda: None,
 })
 
 
@@ -0,0 +1,134 @@
+"""
+Parallel execution of confab tasks across :term:`hosts<host>`.
+
+Hosts are distributed over a bounded pool of worker processes. Each worker
+handles one host at a time, so all :term:`roles<role>` of a host are still
+processed in order. Output produced while working on a host is captured and
+printed as a single block once the host is done, followed by a summary.
+Since workers cannot prompt, hosts that need input (such as a password that
+was not provided up front) fail instead.
+"""
+import signal
+import sys
+from cStringIO import StringIO
+from multiprocessing import Pool
+from traceback import print_exc
+
+from fabric.api import env, settings
+from fabric.colors import green, red
+from fabric.network import disconnect_all
+
+from confab.connections import warm_up
+from confab.iter import get_environmentdef
+
+
+# Task run by worker processes.
+#
+# Set before the pool is created so that forked workers inherit it instead of
+# having to unpickle it (Fabric tasks are not picklable).
+_task = None
+
+
+class HostResult(object):
+    """
+    Outcome of running a task against a single host.
+    """
+
+    def __init__(self, host, output, error=None):
+        self.host = host
+        self.output = output
+        self.error = error
+
+    def __nonzero__(self):
+        """
+        Evaluate to ``True`` if the task succeeded.
+        """
+        return self.error is None
+
+
+def _init_worker():
+    """
+    Leave interrupt handling to the parent process.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _run_for_host(args):
+    """
+    Run the current task against a single host, capturing its output.
+    """
+    host, directory, connect = args
+    error = None
+    buffer_ = StringIO()
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = buffer_
+    try:
+        # prompts cannot be answered while output is captured; fail instead
+        with settings(abort_on_prompts=True):
+            if connect and not all(warm_up([host])):
+                error = 'Unable to connect'
+            else:
+                with settings(environmentdef=env.environmentdef.with_hosts(host)):
+                    _task(directory)
+    except SystemExit:
+        # abort() has already written its own message
+        error = 'Aborted'
+    except Exception as e:
+        print_exc()
+        error = str(e) or e.__class__.__name__
+    finally:
+        # connections are not reused across hosts within a worker
+        disconnect_all()
+        sys.stdout, sys.stderr = stdout, stderr
+    return HostResult(host, buffer_.getvalue(), error)
+
+
+def show_summary(results):
+    """
+    Print the captured output of each host followed by a summary.
+    """
+    for result in results:
+        sys.stdout.write(result.output)
+
+    succeeded = [result for result in results if result]
+    failed = [result for result in results if not result]
+
+    print(green('Succeeded on {count} of {total} host(s)'.format(count=len(succeeded),
+                                                                total=len(results))))
+    for result in failed:
+        print(red('Failed on {host}: {error}'.format(host=result.host,
+                                                     error=result.error)))
+
+
+def run_in_parallel(task, directory=None, jobs=1, warm_up=False):
+    """
+    Run a task against every host in the configured environment using
+    at most ``jobs`` worker processes.
+
+    :param task: task callable accepting a directory (e.g. :func:`confab.push.push`)
+    :param directory: path to templates and data directories.
+    :param jobs: maximum number of hosts to work on concurrently.
+    :param warm_up: connect to each host (see :func:`confab.connections.warm_up`)
+                    before running the task against it.
+
+    Returns a list of :class:`HostResult`, in host order.
+    """
+    global _task
+
+    hosts = [hostdef.host for hostdef in get_environmentdef().hosts()]
+
+    _task = task
+    pool = Pool(processes=max(1, min(jobs, len(hosts))), initializer=_init_worker)
+    try:
+        results = pool.map_async(_run_for_host,
+                                 [(host, directory, warm_up) for host in hosts]).get(sys.maxint)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        _task = None
+
+    show_summary(results)
+    return results
@@ -0,0 +1,153 @@
+"""
+Batched operations on remote :term:`hosts<host>`.
+
+Rather than transferring configuration files one at a time, these functions
+operate on every file of a host with a single remote command.
+"""
+import os
+import tarfile
+from base64 import b64decode
+from cStringIO import StringIO
+from pipes import quote
+from tempfile import mkstemp
+
+from fabric.api import hide, put, run, sudo
+
+# Markers delimiting command output from anything else the remote
+# shell prints (e.g. login banners).
+BEGIN_MARKER = 'CONFAB-BEGIN'
+END_MARKER = 'CONFAB-END'
+
+
+def _relative(path):
+    """
+    Return a remote absolute path relative to the root directory.
+    """
+    return path.lstrip('/')
+
+
+def _run_script(script, use_sudo=True):
+    """
+    Run a shell script on the current host (with sudo by default) and return
+    its (delimited) standard output.
+
+    Standard error is kept separate so that warnings cannot corrupt the
+    output, and pipelines fail if any of their commands fails (using bash's
+    ``pipefail``, so Fabric's ``env.shell`` must be bash, as it is by default).
+    """
+    command = ('cd / && set -o pipefail && echo {begin} && {script} && echo {end}'
+               .format(begin=BEGIN_MARKER, script=script, end=END_MARKER))
+    with hide('running', 'stdout'):
+        output = (sudo if use_sudo else run)(command, pty=False, combine_stderr=False)
+
+    _, _, output = output.partition(BEGIN_MARKER)
+    output, _, _ = output.partition(END_MARKER)
+    return output.strip()
+
+
+def pull_files(paths):
+    """
+    Fetch the contents of remote files from the current host in one transfer.
+
+    The remote host archives the files that exist into a single
+    (base64 encoded) tar stream. Symbolic links are followed, so linked
+    files are fetched with the content they point to.
+
+    :param paths: absolute remote paths.
+
+    Returns a dictionary from path to content for every path that exists;
+    paths that do not exist are omitted.
+    """
+    if not paths:
+        return {}
+
+    script = ('set -- && for f in {paths}; do if [ -f "$f" ]; then set -- "$@" "$f"; fi; done'
+              ' && if [ $# -gt 0 ]; then tar -chzf - "$@" | base64; fi'
+              .format(paths=' '.join(quote(_relative(path)) for path in paths)))
+
+    encoded = _run_script(script)
+    if not encoded:
+        return {}
+
+    contents = {}
+    with tarfile.open(fileobj=StringIO(b64decode(encoded)), mode='r:gz') as archive:
+        for member in archive:
+            # files reached through several (dereferenced) links are stored once,
+            # with the other paths as hard links to the first
+            if member.isfile() or member.islnk():
+                contents['/' + member.name] = archive.extractfile(member).read()
+    return contents
+
+
+def digest_files(paths):
+    """
+    Compute SHA-1 digests of remote files on the current host with one remote command.
+
+    :param paths: absolute remote paths.
+
+    Returns a dictionary from path to hex digest for every path that exists;
+    paths that do not exist are omitted.
+    """
+    if not paths:
+        return {}
+
+    # digests are read from standard input and reported by position, since
+    # sha1sum escapes file names containing backslashes or newlines
+    script = ('i=0 && for f in {paths}; do'
+              ' if [ -f "$f" ]; then d=$(sha1sum < "$f") || exit 1; echo "$i ${{d%% *}}"; fi;'
+              ' i=$((i + 1)); done'
+              .format(paths=' '.join(quote(_relative(path)) for path in paths)))
+
+    digests = {}
+    for line in _run_script(script).splitlines():
+        index, digest = line.split()
+        digests[paths[int(index)]] = digest
+    return digests
+
+
+def push_files(files):
+    """
+    Install local files on the current host with one upload.
+
+    The files are packaged into a single archive preserving their modes, which
+    is uploaded into a private temporary directory. On the remote host, each
+    file is copied next to its destination and then renamed into place, so
+    that every file is replaced atomically.
+
+    :param files: list of (local path, absolute remote path) pairs.
+    """
+    if not files:
+        return
+
+    handle, local_archive = mkstemp(suffix='.tar.gz')
+    try:
+        with os.fdopen(handle, 'wb') as archive_file:
+            with tarfile.open(fileobj=archive_file, mode='w:gz') as archive:
+                for local_path, remote_path in files:
+                    archive.add(local_path, _relative(remote_path))
+
+        # upload into a directory only the connecting user can read, since
+        # the archive may contain secrets
+        remote_dir = _run_script('mktemp -d', use_sudo=False)
+        remote_archive = remote_dir + '/confab.tar.gz'
+        try:
+            with hide('running'):
+                put(local_archive, remote_archive, mode=0600)
+        except:
+            _run_script('rm -rf {}'.format(quote(remote_dir)), use_sudo=False)
+            raise
+    finally:
+        os.remove(local_archive)
+
+    script = ('staging=$(mktemp -d) && trap \'rm -rf "$staging" {remote_dir}\' EXIT'
+              ' && tar -xzf {archive} -C "$staging" --no-same-owner'
+              ' && for f in {paths}; do'
+              ' mkdir -p "$(dirname "$f")"'
+              ' && cp -p "$staging/$f" "$f.confab-tmp"'
+              ' && mv -f "$f.confab-tmp" "$f"'
+              ' || exit 1; done'
+              .format(remote_dir=quote(remote_dir),
+                      archive=quote(remote_archive),
+                      paths=' '.join(quote(_relative(remote_path)) for _, remote_path in files)))
+
+    _run_script(script)
@@ -0,0 +1,107 @@
+"""
+Tests for connecting to hosts.
+"""
+from fabric.api import env, settings
+from fabric.state import connections
+from mock import patch
+from os.path import join
+from nose.tools import eq_, ok_
+from threading import current_thread
+from unittest import TestCase
+
+from confab.connections import _host_configs, get_host_config, warm_up
+from confab.tests.utils import TempDir
+
+
+class TestConnections(TestCase):
+
+    def setUp(self):
+        _host_configs.clear()
+        connections.clear()
+        self.threads = set()
+        self.abort_on_prompts = set()
+
+    def tearDown(self):
+        _host_configs.clear()
+        connections.clear()
+
+    def connect(self, user, host, port, cache):
+        self.threads.add(current_thread().name)
+        self.abort_on_prompts.add(env.abort_on_prompts)
+        if host == 'broken':
+            raise Exception('Connection refused')
+        return (user, host, port)
+
+    def test_host_config_cached(self):
+        """
+        SSH configuration is looked up once per host and configuration.
+        """
+        with patch('confab.connections.ssh_config', return_value={'port': '2222'}) as ssh_config:
+            with settings(use_ssh_config=True):
+                eq_({'port': '2222'}, get_host_config('host1'))
+                eq_({'port': '2222'}, get_host_config('host1'))
+                get_host_config('host2')
+            with settings(use_ssh_config=False):
+                get_host_config('host1')
+
+        eq_(3, ssh_config.call_count)
+
+    def test_warm_up(self):
+        """
+        Connections are opened concurrently, cached and reported with their latency.
+        """
+        with patch('confab.connections.connect', side_effect=self.connect):
+            with settings(user='user'):
+                results = warm_up(['host1', 'host2', 'broken'], jobs=3)
+
+        eq_(['host1', 'host2', 'broken'], [result.host for result in results])
+        ok_(results[0] and results[1] and not results[2])
+        eq_('Connection refused', results[2].error)
+        ok_(results[0].seconds >= 0)
+        eq_(('user', 'host1', '22'), connections['user@host1:22'])
+        ok_('user@broken:22' not in connections)
+        ok_(current_thread().name not in self.threads)
+        # concurrent connections cannot prompt
+        eq_(set([True]), self.abort_on_prompts)
+
+    def test_warm_up_reuses_connections(self):
+        """
+        Hosts that are already connected are not connected to again.
+        """
+        with patch('confab.connections.connect', side_effect=self.connect) as connect:
+            with settings(user='user'):
+                warm_up(['host1'])
+                results = warm_up(['host1'])
+
+        eq_(1, connect.call_count)
+        ok_(results[0].reused)
+        eq_(current_thread().name, self.threads.pop())
+
+    def test_warm_up_with_ssh_config(self):
+        """
+        Hosts are connected to with the port and identity files of their SSH config.
+        """
+        calls = {}
+
+        def ssh_connect(client, hostname, port, key_filename, **kwargs):
+            calls[hostname] = (port, key_filename)
+
+        with TempDir() as tmp_dir:
+            config = join(tmp_dir.path, 'config')
+            with open(config, 'w') as file_:
+                file_.write('Host web1\n  Port 2222\n  IdentityFile /keys/web1\n'
+                            'Host web2\n  IdentityFile /keys/web2\n')
+
+            for jobs in [1, 2]:
+                calls.clear()
+                connections.clear()
+                with patch('paramiko.SSHClient.connect', ssh_connect):
+                    with settings(user='user', use_ssh_config=True, ssh_config_path=config,
+                                  disable_known_hosts=True, key_filename=None):
+                        env.pop('_ssh_config', None)
+                        results = warm_up(['web1', 'web2'], jobs=jobs)
+                        env.pop('_ssh_config', None)
+
+                ok_(all(results))
+                eq_({'web1': (2222, ['/keys/web1']),
+                     'web2': (22, ['/keys/web2'])}, calls)
@@ -1,12 +1,19 @@
 """
 Tests for confab data model.
 """
+from fabric.api import settings
+from os import listdir
 from os.path import dirname, join
-from nose.tools import eq_
+from mock import patch
+from nose.tools import eq_, ok_
 from unittest import TestCase
 
-from confab.data import import_configuration, DataLoader
+from confab.data import (import_configuration, DataLoader,
+                         _load_configuration, _module_indexes, _modules, _render_module)
 from confab.definitions import Settings
+from confab.merge import merge
+from confab.options import Options
+from confab.tests.utils import TempDir
 
 
 class TestData(TestCase):
@@ -138,3 +145,124 @@ class TestData(TestCase):
         eq_(data['prepended'], ['environment', 'default'])
         eq_(data['unique'], ['default'])
         eq_(data['rotated'], ['pivot', 'itemB', 'itemA'])
+
+    def test_host_dependent_callables(self):
+        """
+        Merges involving callables are not shared between components.
+        """
+        self.settings.environmentdefs = {
+            "environment": ["host1", "host2", "host3"],
+        }
+        self.settings.roledefs = {
+            "role": ["host1", "host2", "host3"],
+        }
+        with TempDir() as tmp_dir:
+            with open(join(tmp_dir.path, 'environment.py'), 'w') as file_:
+                file_.write('from fabric.api import env\n'
+                            'from confab.merge import rotate\n'
+                            'servers = rotate(lambda: env.host_string,'
+                            ' ["host1", "host2", "host3"])\n')
+            loader = DataLoader(tmp_dir.path)
+
+            for component in self.settings.for_env("environment").components():
+                with settings(host_string=component.host):
+                    eq_(component.host, loader(component)['servers'][0])
+
+    def test_shared_prefixes(self):
+        """
+        Data shared by components is only loaded and merged once.
+        """
+        self.settings.environmentdefs = {
+            "environment": ["host1", "host2"],
+        }
+        self.settings.roledefs = {
+            "role": ["host1", "host2"],
+        }
+        loader = DataLoader(join(dirname(__file__), 'data/callables'))
+
+        with patch('confab.data.import_configuration', wraps=import_configuration) as import_:
+            data = [loader(component)
+                    for component in self.settings.for_env("environment").components()]
+
+        # default, component, role and environment once; host once per host
+        eq_(6, import_.call_count)
+
+        for component, component_data in zip(self.settings.for_env("environment").components(),
+                                             data):
+            eq_(component.host, component_data['confab']['host'])
+            eq_(['default', 'environment'], component_data['appended'])
+
+            modules = [import_configuration(name, join(dirname(__file__), 'data/callables'),
+                                            scope=scope)
+                       for scope, name in loader._list_modules(component)]
+            eq_(merge(dict(confab=component_data['confab']), *modules), component_data)
+
+    def test_data_template_cache(self):
+        """
+        Data templates are rendered once per data directory.
+        """
+        with TempDir() as tmp_dir:
+            with open(join(tmp_dir.path, 'templated.py_tmpl'), 'w') as file_:
+                file_.write("value = '{{ 'templated' }}'")
+
+            with patch('confab.data._render_module', wraps=_render_module) as render:
+                with patch('confab.data._load_configuration',
+                           wraps=_load_configuration) as load:
+                    for _ in range(2):
+                        eq_({'value': 'templated'},
+                            import_configuration('templated', tmp_dir.path))
+                        eq_({}, import_configuration('missing', tmp_dir.path))
+
+            # the missing module is not in the data directory's index
+            eq_(1, render.call_count)
+            eq_(1, load.call_count)
+
+    def test_data_template_disk_cache(self):
+        """
+        Rendered data templates are cached on disk if a cache directory is configured.
+        """
+        with TempDir() as tmp_dir:
+            with open(join(tmp_dir.path, 'templated.py_tmpl'), 'w') as file_:
+                file_.write("value = '{{ 'templated' }}'")
+
+            with Options(get_cache_dir=lambda: join(tmp_dir.path, 'cache')):
+                import_configuration('templated', tmp_dir.path)
+                eq_(1, len(listdir(join(tmp_dir.path, 'cache', 'data'))))
+
+                _modules.clear()
+                with patch('jinja2.Template.render') as render:
+                    eq_({'value': 'templated'},
+                        import_configuration('templated', tmp_dir.path))
+                ok_(not render.called)
+
+    def test_module_index(self):
+        """
+        Data directories are listed once and missing modules are not looked for.
+        """
+        data_dir = join(dirname(__file__), 'data/callables')
+        _module_indexes.pop(data_dir, None)
+
+        with patch('confab.data.listdir', wraps=listdir) as listdir_:
+            with patch('imp.find_module') as find_module:
+                for _ in range(2):
+                    eq_({}, import_configuration('missing', data_dir))
+                    eq_({}, import_configuration('nothing', data_dir))
+
+        eq_(1, listdir_.call_count)
+        ok_(not find_module.called)
+        ok_('default' in _module_indexes[data_dir])
+
+    def test_lazy_data(self):
+        """
+        Lazily merged data matches eagerly merged data.
+        """
+        data_dir = join(dirname(__file__), 'data/callables')
+
+        lazy = DataLoader(data_dir, lazy=True)(self.component)
+
+        eq_(DataLoader(data_dir)(self.component), lazy)
+        eq_('host', lazy['confab']['host'])
+        eq_(['default', 'environment'], lazy['appended'])
+
+        with Options(lazy_data=True):
+            eq_(lazy, DataLoader(data_dir)(self.component))
@@ -1,12 +1,16 @@
 """
 Test definition functions.
 """
-from os.path import dirname, join
-from nose.tools import eq_
+from os import listdir
+from os.path import dirname, exists, join
+from shutil import copy
+from mock import patch
+from nose.tools import eq_, ok_
 from unittest import TestCase
 from warnings import catch_warnings
 
 from confab.definitions import Settings
+from confab.tests.utils import TempDir
 
 
 class TestSettings(TestCase):
@@ -63,6 +67,35 @@ class TestSettings(TestCase):
         eq_(["component1"], self.settings.componentdefs["role1"])
 
 
+    def test_snapshot(self):
+        """
+        Settings can be loaded from a snapshot while the settings module is unchanged.
+        """
+        with TempDir() as tmp_dir:
+            copy(join(self.dir_name, "example.py"), join(tmp_dir.path, "settings.py"))
+
+            settings = Settings.load_from_module(tmp_dir.path, snapshot=True)
+            ok_(exists(join(tmp_dir.path, "settings.snapshot")))
+            ok_(not [name for name in listdir(tmp_dir.path) if name.endswith(".tmp")])
+
+            with patch("confab.definitions._import") as import_:
+                snapshot = Settings.load_from_module(tmp_dir.path, snapshot=True)
+            ok_(not import_.called)
+
+            eq_(tmp_dir.path, snapshot.directory)
+            for key in Settings.KEYS:
+                eq_(getattr(settings, key), getattr(snapshot, key))
+            eq_(settings._host_roles, snapshot._host_roles)
+            eq_(settings._components, snapshot._components)
+            # host2 has no roles
+            with self.assertRaises(Exception):
+                snapshot.for_env("environment1")
+
+            with open(join(tmp_dir.path, "settings.py"), "a") as settings_file:
+                settings_file.write("\n# changed\n")
+            eq_(None, Settings.load_from_snapshot(join(tmp_dir.path, "settings.py")))
+
+
 class TestEnvironment(TestCase):
     """
     Tests for environment selection.
@@ -109,6 +142,31 @@ class TestEnvironment(TestCase):
         eq_({"foo": ["role"]},
             self.settings.for_env("bar").host_roles)
 
+    def test_roles_index(self):
+        """
+        Roles are indexed by host once and reindexed when role definitions change.
+        """
+        self.settings.environmentdefs = {
+            "foo": ["bar", "baz"],
+        }
+        self.settings.roledefs = {
+            "role1": ["bar", "baz", "bar"],
+            "role2": ["baz"],
+        }
+
+        eq_(["role1"], self.settings._roles_for_host("bar"))
+        eq_(sorted(["role1", "role2"]), sorted(self.settings._roles_for_host("baz")))
+        eq_([], self.settings._roles_for_host("unknown"))
+        index = self.settings._host_roles
+        self.settings.for_env("foo")
+        ok_(index is self.settings._host_roles)
+
+        self.settings.roledefs = {
+            "role3": ["bar"],
+        }
+        eq_(["role3"], self.settings._roles_for_host("bar"))
+        eq_([], self.settings._roles_for_host("baz"))
+
     def test_host_without_roles(self):
         """
         Fail if an environment host has no roles
@@ -405,6 +463,46 @@ class TestComponents(TestCase):
             map(lambda c: c.name, self.settings.for_env("env").with_roles("role1").components())
 
 
+    def test_cycle_on_load(self):
+        """
+        Cycles are detected when settings are loaded.
+        """
+        with self.assertRaises(Exception):
+            Settings.load_from_dict({
+                "environmentdefs": {"env": ["host1"]},
+                "roledefs": {"role1": ["host1"]},
+                "componentdefs": {"role1": ["compgroup"], "compgroup": ["role1"]},
+            })
+
+    def test_components_memoized(self):
+        """
+        Components are expanded once per role; host roles once per environment.
+        """
+        self.settings.environmentdefs = {
+            "env": ["host1", "host2"],
+        }
+        self.settings.roledefs = {
+            "role1": ["host1", "host2"],
+        }
+        self.settings.componentdefs = {
+            "role1": ["comp1", "compgroup"],
+            "compgroup": ["comp2"],
+        }
+        environmentdef = self.settings.for_env("env")
+
+        with patch.object(Settings, "_expand_components",
+                          wraps=self.settings._expand_components) as expand:
+            for _ in range(2):
+                eq_(["comp1", "comp2", "comp1", "comp2"],
+                    [component.name for component in environmentdef.components()])
+        # role1, comp1, compgroup and comp2 are each visited once
+        eq_(4, expand.call_count)
+        ok_(environmentdef.host_roles is environmentdef.host_roles)
+
+        self.settings.componentdefs = {}
+        eq_(["role1", "role1"], [component.name for component in environmentdef.components()])
+
+
 class TestHostDefinition(TestCase):
     """
     Test host iteration.
@@ -465,3 +563,23 @@ class TestHostDefinition(TestCase):
 
         eq_({},
             get_hosts_components(self.settings.for_env("test3")))
+
+    def test_definitions_interned(self):
+        """
+        Definitions are reused across iterations and compare by value.
+        """
+        environmentdef = self.settings.for_env("test1")
+
+        components = list(environmentdef.components())
+        for component, again in zip(components, environmentdef.components()):
+            ok_(component is again)
+        for host, again in zip(environmentdef.hosts(), environmentdef.hosts()):
+            ok_(host is again)
+
+        other = list(self.settings.for_env("test1").components())
+        eq_(components, other)
+        eq_(set(components), set(other))
+        ok_(components[0] is not other[0])
+
+        with self.assertRaises(AttributeError):
+            components[0].extra = True
@@ -3,11 +3,13 @@ Tests for template generation.
 """
 from unittest import TestCase
 from jinja2 import UndefinedError
-from os.path import join, dirname
+from mock import patch
+from os import makedirs, utime
+from os.path import exists, join, dirname
 from nose.tools import eq_, ok_
 import filecmp
 
-from confab.conffiles import ConfFiles
+from confab.conffiles import ConfFile, ConfFiles
 from confab.definitions import Settings
 from confab.loaders import PackageEnvironmentLoader, FileSystemEnvironmentLoader
 from confab.data import DataLoader
@@ -15,6 +17,20 @@ from confab.options import Options
 from confab.tests.utils import TempDir
 
 
+class RenderCounter(object):
+    """
+    Template value that counts how often it is rendered.
+    """
+
+    def __init__(self, value):
+        self.value = value
+        self.count = 0
+
+    def __unicode__(self):
+        self.count += 1
+        return self.value
+
+
 class TestGenerate(TestCase):
 
     def setUp(self):
@@ -71,6 +87,165 @@ class TestGenerate(TestCase):
             with self.assertRaises(UndefinedError):
                 conffiles.generate(tmp_dir.path)
 
+    def test_render_once(self):
+        """
+        Templates are rendered once for generation, digests and diffs.
+        """
+        foo = RenderCounter(u'foo')
+        conffiles = ConfFiles(self.settings.for_env('any').all().next(),
+                              PackageEnvironmentLoader('confab.tests', 'templates/default'),
+                              lambda _: {'bar': 'bar', 'foo': foo})
+        conffile = next(conffile for conffile in conffiles.conffiles if conffile.name == 'foo.txt')
+
+        with TempDir() as tmp_dir:
+            conffiles.generate(tmp_dir.path)
+            conffile.hexdigest()
+            conffile.diff(join(tmp_dir.path, 'generated/localhost'),
+                          join(tmp_dir.path, 'remotes/localhost'))
+            eq_(1, foo.count)
+
+            # new data is rendered again
+            conffile.data = {'foo': u'bar'}
+            conffiles.generate(tmp_dir.path)
+            eq_('bar', tmp_dir.read('generated/localhost/foo.txt'))
+
+    def test_share_content(self):
+        """
+        Content that does not depend on the host is rendered once for hosts with the same data.
+        """
+        self.settings.environmentdefs = {'any': ['host1', 'host2']}
+        self.settings.roledefs = {'role': ['host1', 'host2']}
+
+        foo = RenderCounter(u'foo')
+        with TempDir() as tmp_dir:
+            templates_dir = join(tmp_dir.path, 'templates')
+            makedirs(join(templates_dir, 'role'))
+            for name, template in [('shared.txt', '{{ foo }}'),
+                                   ('host.txt', '{{ foo }} {{ confab.host }}')]:
+                with open(join(templates_dir, 'role', name), 'w') as file_:
+                    file_.write(template)
+
+            environment_loader = FileSystemEnvironmentLoader(templates_dir)
+            with Options(share_content=True):
+                for host_and_role in self.settings.for_env('any').all():
+                    conffiles = ConfFiles(host_and_role,
+                                          environment_loader,
+                                          lambda component: {'foo': foo,
+                                                             'confab': {'host': component.host}})
+                    conffiles.generate(tmp_dir.path)
+
+            for host in ['host1', 'host2']:
+                eq_('foo', tmp_dir.read('generated/{}/shared.txt'.format(host)))
+                eq_('foo {}'.format(host), tmp_dir.read('generated/{}/host.txt'.format(host)))
+            # once for shared.txt and once per host for host.txt,
+            # plus once per template to track the keys it reads
+            eq_(5, foo.count)
+
+    def test_share_untrackable_content(self):
+        """
+        Templates that need actual dictionaries are rendered normally and not shared.
+        """
+        self.settings.environmentdefs = {'any': ['host1', 'host2']}
+        self.settings.roledefs = {'role': ['host1', 'host2']}
+
+        with TempDir() as tmp_dir:
+            templates_dir = join(tmp_dir.path, 'templates')
+            makedirs(join(templates_dir, 'role'))
+            with open(join(templates_dir, 'role', 'confab.txt'), 'w') as file_:
+                file_.write('{{ confab.viewkeys()|sort|join(",") }} {{ confab.host }}')
+
+            environment_loader = FileSystemEnvironmentLoader(templates_dir)
+            with Options(share_content=True):
+                for host_and_role in self.settings.for_env('any').all():
+                    ConfFiles(host_and_role,
+                              environment_loader,
+                              lambda component: {'confab': {'host': component.host}}
+                              ).generate(tmp_dir.path)
+
+            for host in ['host1', 'host2']:
+                eq_('host {}'.format(host), tmp_dir.read('generated/{}/confab.txt'.format(host)))
+
+    def test_incremental(self):
+        """
+        Incremental generation only rewrites files whose inputs changed and
+        removes files that are no longer generated.
+        """
+        def make_conffiles(foo, filter_func=lambda _: True):
+            with Options(filter_func=filter_func):
+                return ConfFiles(self.settings.for_env('any').all().next(),
+                                 PackageEnvironmentLoader('confab.tests', 'templates/default'),
+                                 lambda _: {'bar': 'bar', 'foo': foo})
+
+        with TempDir() as tmp_dir:
+            foo_txt = join(tmp_dir.path, 'generated/localhost/foo.txt')
+            bar_txt = join(tmp_dir.path, 'generated/localhost/bar/bar.txt')
+
+            with Options(incremental=True):
+                make_conffiles('foo').generate(tmp_dir.path)
+                eq_('foo', tmp_dir.read('generated/localhost/foo.txt'))
+
+                # unchanged inputs
+                with patch.object(ConfFile, 'generate') as generate:
+                    make_conffiles('foo').generate(tmp_dir.path)
+                    ok_(not generate.called)
+
+                # changed data
+                make_conffiles('baz').generate(tmp_dir.path)
+                eq_('baz', tmp_dir.read('generated/localhost/foo.txt'))
+
+                # modified output
+                with open(bar_txt, 'w') as file_:
+                    file_.write('modified')
+                make_conffiles('baz').generate(tmp_dir.path)
+                eq_('bar', tmp_dir.read('generated/localhost/bar/bar.txt'))
+
+                # output rewritten by a non-incremental run
+                with Options(incremental=False):
+                    make_conffiles('qux').generate(tmp_dir.path)
+                make_conffiles('baz').generate(tmp_dir.path)
+                eq_('baz', tmp_dir.read('generated/localhost/foo.txt'))
+
+                # stale output
+                make_conffiles('baz', lambda name: name != 'foo.txt').generate(tmp_dir.path)
+                ok_(not exists(foo_txt))
+                ok_(exists(bar_txt))
+
+    def test_incremental_parses_templates_once(self):
+        """
+        Template sources are parsed once for all hosts, and again once they change.
+        """
+        self.settings.environmentdefs = {'any': ['host1', 'host2']}
+        self.settings.roledefs = {'role': ['host1', 'host2']}
+
+        with TempDir() as tmp_dir:
+            templates_dir = join(tmp_dir.path, 'templates')
+            makedirs(join(templates_dir, 'role'))
+            template = join(templates_dir, 'role', 'foo.txt')
+            with open(template, 'w') as file_:
+                file_.write('{{ foo }}')
+            environment_loader = FileSystemEnvironmentLoader(templates_dir)
+
+            def generate():
+                for host_and_role in self.settings.for_env('any').all():
+                    ConfFiles(host_and_role,
+                              environment_loader,
+                              lambda _: {'foo': 'foo'}).generate(tmp_dir.path)
+
+            environment = environment_loader('role')
+            with Options(incremental=True):
+                with patch.object(environment, 'parse', wraps=environment.parse) as parse:
+                    generate()
+                    generate()
+                    eq_(1, parse.call_count)
+
+                    with open(template, 'w') as file_:
+                        file_.write('{{ foo }} changed')
+                    utime(template, (0, 0))
+                    generate()
+                    eq_(2, parse.call_count)
+
+            eq_('foo changed', tmp_dir.read('generated/host2/foo.txt'))
+
     def test_should_render(self):
         """
         Passing a mime_type_func controls whether templates are rendered.
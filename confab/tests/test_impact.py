@@ -0,0 +1,106 @@
+"""
+Tests for impact analysis.
+"""
+from mock import patch
+from nose.tools import eq_
+from os import makedirs
+from os.path import dirname, join
+from unittest import TestCase
+
+from confab.definitions import Settings
+from confab.impact import _template_files, build_impact_index
+from confab.tests.utils import TempDir
+
+
+def write(path, content=''):
+    if not dirname(path) == '':
+        try:
+            makedirs(dirname(path))
+        except OSError:
+            pass
+    with open(path, 'w') as file_:
+        file_.write(content)
+
+
+class TestImpact(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TempDir().__enter__()
+        write(self.path('templates/role1/etc/role1.conf'), '{% include "common.inc" %}')
+        write(self.path('templates/role1/common.inc'), '{{ foo }}')
+        write(self.path('templates/comp/etc/{{ bar }}.conf'), '{{ bar }}')
+        write(self.path('data/default.py'), 'foo = "foo"')
+        write(self.path('data/environment/prod.py'), 'bar = "bar"')
+        write(self.path('data/host2.py_tmpl'), '{% include "host2.inc" %}')
+        write(self.path('data/host2.inc'), 'bar = "baz"')
+
+        self.settings = Settings.load_from_dict(dict(
+            environmentdefs={'prod': ['host1', 'host2']},
+            roledefs={'role1': ['host1'], 'role2': ['host2']},
+            componentdefs={'role2': ['comp']}))
+
+        with patch('confab.iter.iter_extension_paths', lambda: []):
+            self.index = build_impact_index(self.settings.for_env('prod'), self.tmp_dir.path)
+
+    def tearDown(self):
+        self.tmp_dir.__exit__(None, None, None)
+
+    def path(self, path):
+        return join(self.tmp_dir.path, path)
+
+    def test_template(self):
+        """
+        Templates (and the templates they include) affect their configuration files.
+        """
+        eq_([('host1', 'role1', 'common.inc'),
+             ('host1', 'role1', 'etc/role1.conf')],
+            self.index.impact(self.path('templates/role1/common.inc')))
+        eq_([('host2', 'comp', 'etc/{{ bar }}.conf')],
+            self.index.impact(self.path('templates/comp/etc/{{ bar }}.conf')))
+
+    def test_data(self):
+        """
+        Data modules affect every configuration file of the components that load them.
+        """
+        eq_([('host1', 'role1', 'common.inc'),
+             ('host1', 'role1', 'etc/role1.conf'),
+             ('host2', 'comp', 'etc/{{ bar }}.conf')],
+            self.index.impact(self.path('data/environment/prod.py')))
+        eq_([('host2', 'comp', 'etc/{{ bar }}.conf')],
+            self.index.impact(self.path('data/host2.inc')))
+
+    def test_missing_data_module(self):
+        """
+        Adding a data module affects the components that would load it.
+        """
+        eq_([('host1', 'role1', 'common.inc'),
+             ('host1', 'role1', 'etc/role1.conf')],
+            self.index.impact(self.path('data/host/host1.py')))
+
+    def test_directory(self):
+        """
+        Directories affect everything that depends on files below them.
+        """
+        eq_([('host1', 'role1', 'common.inc'),
+             ('host1', 'role1', 'etc/role1.conf')],
+            self.index.impact(self.path('templates/role1')))
+        eq_([], self.index.impact(self.path('templates/unused')))
+
+    def test_templates_once_per_component(self):
+        """
+        Template dependencies are determined once per component, not once per host.
+        """
+        settings = Settings.load_from_dict(dict(
+            environmentdefs={'prod': ['host1', 'host3']},
+            roledefs={'role1': ['host1', 'host3']}))
+
+        with patch('confab.iter.iter_extension_paths', lambda: []):
+            with patch('confab.impact._template_files', wraps=_template_files) as template_files:
+                index = build_impact_index(settings.for_env('prod'), self.tmp_dir.path)
+
+        eq_(2, template_files.call_count)
+        eq_([('host1', 'role1', 'common.inc'),
+             ('host1', 'role1', 'etc/role1.conf'),
+             ('host3', 'role1', 'common.inc'),
+             ('host3', 'role1', 'etc/role1.conf')],
+            index.impact(self.path('templates/role1/common.inc')))
@@ -2,7 +2,7 @@
 Tests for custom Jinja filters.
 """
 from unittest import TestCase
-from nose.tools import eq_
+from nose.tools import eq_, ok_
 
 from confab.conffiles import ConfFiles
 from confab.definitions import Settings
@@ -63,3 +63,20 @@ class TestJinjaFilters(TestCase):
             conffiles.generate(tmp_dir.path)
 
             eq_('foofoofoo', tmp_dir.read('generated/localhost/foo.txt'))
+
+    def test_shared_environment(self):
+        """
+        Filters are updated on environments shared between conffiles.
+        """
+        def multiply(value, mult):
+            return value * mult
+
+        loader = PackageEnvironmentLoader('confab.tests', 'templates/jinjafilters/user')
+        host_and_role = self.settings.for_env('any').all().next()
+
+        with JinjaFilters(multiply):
+            ConfFiles(host_and_role, loader, lambda _: {'foo': 'foo'})
+            eq_(multiply, loader('role').filters['multiply'])
+
+        ConfFiles(host_and_role, loader, lambda _: {'foo': 'foo'})
+        ok_('multiply' not in loader('role').filters)
@@ -44,11 +44,24 @@ class TestListing(TestCase):
         """
         Raise an error if a template value is undefined.
         """
+        conffiles = ConfFiles(self.settings.for_env('any').all().next(),
+                              PackageEnvironmentLoader('confab.tests', 'templates/default'),
+                              lambda _: {})
 
         with self.assertRaises(UndefinedError):
-            ConfFiles(self.settings.for_env('any').all().next(),
-                      PackageEnvironmentLoader('confab.tests', 'templates/default'),
-                      lambda _: {})
+            map(lambda x: x.name, conffiles.conffiles)
+
+    def test_lazy_templates(self):
+        """
+        Templates are not loaded until needed.
+        """
+        conffiles = ConfFiles(self.settings.for_env('any').all().next(),
+                              PackageEnvironmentLoader('confab.tests', 'templates/default'),
+                              lambda _: {'bar': 'bar'})
+
+        names = map(lambda x: x.name, conffiles.conffiles)
+        self.assertTrue('bar/bar.txt' in names)
+        ok_(all(conffile._template is None for conffile in conffiles.conffiles))
 
     def test_filter_func(self):
         """
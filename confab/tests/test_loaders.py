@@ -0,0 +1,78 @@
+"""
+Tests for Jinja2 environment loading.
+"""
+from mock import patch
+from nose.tools import eq_, ok_
+from os import listdir
+from os.path import basename, dirname, join
+from unittest import TestCase
+
+from confab.loaders import FileSystemEnvironmentLoader, PackageEnvironmentLoader
+from confab.tests.utils import TempDir
+
+
+class TestLoaders(TestCase):
+
+    def test_file_system_environments_are_shared(self):
+        """
+        Environments are created once per sub-directory.
+        """
+        loader = FileSystemEnvironmentLoader(join(dirname(__file__), 'templates/default'))
+
+        environment = loader('role')
+        ok_(environment is loader('role'))
+        ok_(environment is not loader('missing'))
+        ok_(environment.get_template('foo.txt') is environment.get_template('foo.txt'))
+
+    def test_package_environments_are_shared(self):
+        """
+        Environments are created once per sub-directory.
+        """
+        loader = PackageEnvironmentLoader('confab.tests', 'templates/default')
+
+        environment = loader('role')
+        ok_(environment is loader('role'))
+        eq_(['foo.txt', '{{bar}}/bar.txt'], sorted(environment.list_templates()))
+
+    def test_bytecode_cache(self):
+        """
+        Compiled templates are cached on disk and reused by other loaders.
+        """
+        templates_dir = join(dirname(__file__), 'templates/default')
+
+        with TempDir() as tmp_dir:
+            cache_dir = join(tmp_dir.path, 'cache')
+
+            loader = FileSystemEnvironmentLoader(templates_dir, bytecode_cache_dir=cache_dir)
+            eq_('foo', loader('role').get_template('foo.txt').render(foo='foo'))
+            eq_(1, len(listdir(cache_dir)))
+
+            loader = FileSystemEnvironmentLoader(templates_dir, bytecode_cache_dir=cache_dir)
+            environment = loader('role')
+            with patch.object(environment, 'compile') as compile_:
+                eq_('foo', environment.get_template('foo.txt').render(foo='foo'))
+                ok_(not compile_.called)
+
+    def test_truncated_bytecode_cache(self):
+        """
+        Unreadable cache files are treated as cache misses.
+        """
+        templates_dir = join(dirname(__file__), 'templates/default')
+
+        with TempDir() as tmp_dir:
+            cache_dir = join(tmp_dir.path, 'cache')
+
+            loader = FileSystemEnvironmentLoader(templates_dir, bytecode_cache_dir=cache_dir)
+            loader('role').get_template('foo.txt')
+            cache_file_name = join(cache_dir, listdir(cache_dir)[0])
+            with open(cache_file_name, 'rb') as cache_file:
+                content = cache_file.read()
+            with open(cache_file_name, 'wb') as cache_file:
+                cache_file.write(content[:-10])
+
+            loader = FileSystemEnvironmentLoader(templates_dir, bytecode_cache_dir=cache_dir)
+            eq_('foo', loader('role').get_template('foo.txt').render(foo='foo'))
+            # the cache file is replaced
+            eq_([basename(cache_file_name)], listdir(cache_dir))
+            with open(cache_file_name, 'rb') as cache_file:
+                eq_(content, cache_file.read())
@@ -1,4 +1,5 @@
-from confab.merge import merge, append, prepend
+import json
+from confab.merge import LazyMerge, merge, append, prepend
 
 from unittest import TestCase
 
@@ -107,6 +108,98 @@ class TestMerge(TestCase):
         self.check_override({}, {'key': ''}, {'key': ''})
         self.check_override({}, {'key': None}, {'key': None})
 
+    def test_structural_sharing(self):
+        """
+        Unchanged values are shared with the default rather than copied.
+        """
+
+        default = {
+            'list': ['foo'],
+            'unchanged': {
+                'value': 'foo'
+            },
+            'same': {
+                'value': 'foo'
+            },
+            'changed': {
+                'value': 'foo',
+                'nested': {
+                    'value': 'foo'
+                }
+            }
+        }
+
+        override = {
+            'same': {
+                'value': 'foo'
+            },
+            'changed': {
+                'value': 'bar'
+            }
+        }
+
+        merged = merge(default, override)
+
+        self.assertEqual('bar', merged['changed']['value'])
+        self.assertTrue(merged['list'] is default['list'])
+        self.assertTrue(merged['unchanged'] is default['unchanged'])
+        self.assertTrue(merged['same'] is default['same'])
+        self.assertTrue(merged['changed']['nested'] is default['changed']['nested'])
+        # inputs are not modified
+        self.assertEqual('foo', default['changed']['value'])
+
+    def test_lazy_merge(self):
+        """
+        Lazy merges match eager merges.
+        """
+
+        layers = [
+            {'confab': {'host': 'host'}},
+            {
+                'value': 'foo',
+                'list': ['one'],
+                'dict': {'value1': 'foo', 'value2': 'foo', 'list': ['one']},
+                'replaced': {'value': 'foo'},
+            },
+            {
+                'list': append('two'),
+                'dict': {'value2': 'bar', 'list': prepend('zero'), 'nested': {'value': 'bar'}},
+                'replaced': 'bar',
+                'new': {'value': 'bar'},
+            },
+        ]
+
+        lazy = LazyMerge(*layers)
+
+        self.assertEqual(merge(*layers), lazy)
+        self.assertEqual(['one', 'two'], lazy['list'])
+        self.assertEqual(['zero', 'one'], lazy['dict']['list'])
+        self.assertEqual('bar', lazy['replaced'])
+        self.assertTrue(lazy['new'] is layers[2]['new'])
+        self.assertTrue(type(lazy['dict']) is dict)
+        self.assertEqual(lazy['dict'], json.loads(json.dumps(lazy['dict'])))
+        self.assertFalse('missing' in lazy)
+        with self.assertRaises(KeyError):
+            lazy['missing']
+
+    def test_lazy_merge_on_access(self):
+        """
+        Lazy merges only merge values that are accessed.
+        """
+
+        calls = []
+
+        def record(default):
+            calls.append(default)
+            return 'recorded'
+
+        lazy = LazyMerge({'used': 'foo', 'unused': 'foo'},
+                         {'used': record, 'unused': record})
+
+        self.assertEqual('recorded', lazy['used'])
+        self.assertEqual('recorded', lazy['used'])
+        self.assertEqual(['foo'], calls)
+
     def check_override(self, default, override, expected=None):
 
         merged = merge(default, override)
@@ -0,0 +1,46 @@
+"""
+Tests for confab options.
+"""
+from mock import Mock, patch
+from nose.tools import eq_
+from os import utime
+from os.path import join
+from unittest import TestCase
+
+from confab.options import _get_mime_type
+from confab.tests.utils import TempDir
+
+
+class TestMimeType(TestCase):
+
+    def test_mime_type(self):
+        """
+        Mime types are detected.
+        """
+        with TempDir() as tmp_dir:
+            file_name = join(tmp_dir.path, 'foo.txt')
+            with open(file_name, 'w') as file_:
+                file_.write('foo')
+
+            eq_('text/plain', _get_mime_type(file_name))
+
+    def test_mime_type_cache(self):
+        """
+        Files are examined once unless they are modified.
+        """
+        magic = Mock()
+        magic.from_file.return_value = 'text/plain'
+
+        with TempDir() as tmp_dir:
+            file_name = join(tmp_dir.path, 'foo.txt')
+            with open(file_name, 'w') as file_:
+                file_.write('foo')
+
+            with patch('confab.options._magic', magic):
+                eq_('text/plain', _get_mime_type(file_name))
+                eq_('text/plain', _get_mime_type(file_name))
+                eq_(1, magic.from_file.call_count)
+
+                utime(file_name, (0, 0))
+                eq_('text/plain', _get_mime_type(file_name))
+                eq_(2, magic.from_file.call_count)
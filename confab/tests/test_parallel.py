@@ -0,0 +1,74 @@
+"""
+Tests for parallel execution across hosts.
+"""
+from fabric.api import abort, prompt, settings
+from nose.tools import eq_, ok_
+from unittest import TestCase
+
+from confab.definitions import Settings
+from confab.iter import iter_hosts
+from confab.parallel import run_in_parallel
+
+
+def _print_hosts(directory):
+    for hostdef in iter_hosts():
+        print('{} in {}'.format(hostdef.host, directory))
+
+
+def _fail_on_host2(directory):
+    for hostdef in iter_hosts():
+        if hostdef.host == 'host2':
+            abort('host2 is broken')
+        if hostdef.host == 'host3':
+            raise Exception('host3 is broken')
+
+
+def _prompt(directory):
+    prompt('Password:')
+
+
+class TestParallel(TestCase):
+
+    def setUp(self):
+        self.settings = Settings.load_from_dict(dict(
+            environmentdefs={'any': ['host1', 'host2', 'host3']},
+            roledefs={'role': ['host1', 'host2', 'host3']}))
+
+    def test_run_in_parallel(self):
+        """
+        Each host is handled separately and its output is captured.
+        """
+        with settings(environmentdef=self.settings.for_env('any')):
+            results = run_in_parallel(_print_hosts, 'dir', jobs=2)
+
+        eq_(['host1', 'host2', 'host3'], sorted(result.host for result in results))
+        for result in results:
+            ok_(result)
+            eq_('{} in dir\n'.format(result.host), result.output)
+
+    def test_errors_per_host(self):
+        """
+        Failures on one host are collected without affecting other hosts.
+        """
+        with settings(environmentdef=self.settings.for_env('any')):
+            results = run_in_parallel(_fail_on_host2, jobs=3)
+
+        results = {result.host: result for result in results}
+        ok_(results['host1'])
+        ok_(not results['host2'])
+        eq_('Aborted', results['host2'].error)
+        ok_('host2 is broken' in results['host2'].output)
+        ok_(not results['host3'])
+        eq_('host3 is broken', results['host3'].error)
+
+    def test_no_prompts(self):
+        """
+        Hosts that would prompt for input fail instead.
+        """
+        with settings(environmentdef=self.settings.for_env('any')):
+            results = run_in_parallel(_prompt, jobs=2)
+
+        for result in results:
+            ok_(not result)
+            eq_('Aborted', result.error)
+            ok_('Needed to prompt' in result.output)
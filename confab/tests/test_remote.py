@@ -0,0 +1,341 @@
+"""
+Tests for batched remote operations.
+"""
+from cStringIO import StringIO
+from hashlib import sha1
+from mock import patch
+from nose.tools import eq_, ok_
+from os import chmod, listdir, makedirs, stat, symlink
+from os.path import dirname, exists, join
+from shutil import copy
+from subprocess import check_output
+from unittest import TestCase
+
+from confab.conffiles import ConfFiles
+from confab.definitions import Settings
+from confab.loaders import FileSystemEnvironmentLoader
+from confab.options import Options
+from confab.remote import digest_files, pull_files, push_files
+from confab.tests.utils import TempDir
+
+
+def local_sudo(command, **kwargs):
+    """
+    Run a command locally in place of ``fabric.api.sudo``.
+    """
+    return check_output(['/bin/bash', '-c', command])
+
+
+def local_put(local_path, remote_path, mode=None):
+    """
+    Copy a file locally in place of ``fabric.api.put``.
+    """
+    copy(local_path, remote_path)
+    if mode is not None:
+        chmod(remote_path, mode)
+
+
+def write(path, content):
+    with open(path, 'w') as file_:
+        file_.write(content)
+
+
+@patch('confab.remote.sudo', local_sudo)
+class TestPull(TestCase):
+
+    def test_pull_files(self):
+        """
+        Existing files are fetched; missing files are omitted.
+        """
+        with TempDir() as tmp_dir:
+            makedirs(join(tmp_dir.path, 'etc'))
+            write(join(tmp_dir.path, 'etc/foo.conf'), 'foo\n')
+            write(join(tmp_dir.path, 'bar conf'), 'bar')
+
+            paths = [join(tmp_dir.path, 'etc/foo.conf'),
+                     join(tmp_dir.path, 'bar conf'),
+                     join(tmp_dir.path, 'missing.conf')]
+
+            eq_({paths[0]: 'foo\n', paths[1]: 'bar'}, pull_files(paths))
+
+    def test_pull_symlinks(self):
+        """
+        Symbolic links are fetched with the content of the files they point to.
+        """
+        with TempDir() as tmp_dir:
+            write(join(tmp_dir.path, 'real.conf'), 'real')
+            symlink(join(tmp_dir.path, 'real.conf'), join(tmp_dir.path, 'link.conf'))
+
+            paths = [join(tmp_dir.path, 'link.conf'), join(tmp_dir.path, 'real.conf')]
+
+            eq_({paths[0]: 'real', paths[1]: 'real'}, pull_files(paths))
+            eq_(digest_files(paths)[paths[0]], digest_files(paths)[paths[1]])
+
+    def test_pull_no_files(self):
+        """
+        Nothing is fetched if no files exist.
+        """
+        with TempDir() as tmp_dir:
+            eq_({}, pull_files([join(tmp_dir.path, 'missing.conf')]))
+        eq_({}, pull_files([]))
+
+    def test_conffiles_pull(self):
+        """
+        ConfFiles pulls all remote files into the remotes directory.
+        """
+        with TempDir() as tmp_dir:
+            templates_dir = join(tmp_dir.path, 'templates')
+            remote_dir = join(tmp_dir.path, 'remote')
+            makedirs(join(templates_dir, 'role', remote_dir[1:]))
+            makedirs(remote_dir)
+            write(join(templates_dir, 'role', remote_dir[1:], 'foo.txt'), '{{foo}}')
+            write(join(templates_dir, 'role', remote_dir[1:], 'bar.txt'), '{{bar}}')
+            write(join(remote_dir, 'foo.txt'), 'remote foo')
+
+            settings = Settings.load_from_dict(dict(environmentdefs={'any': ['host']},
+                                                    roledefs={'role': ['host']}))
+            conffiles = ConfFiles(settings.for_env('any').all().next(),
+                                  FileSystemEnvironmentLoader(templates_dir),
+                                  lambda _: {'foo': 'foo', 'bar': 'bar'})
+            conffiles.pull(tmp_dir.path)
+
+            eq_('remote foo', tmp_dir.read(join('remotes/host', remote_dir[1:], 'foo.txt')))
+            with self.assertRaises(IOError):
+                tmp_dir.read(join('remotes/host', remote_dir[1:], 'bar.txt'))
+
+
+@patch('confab.remote.sudo', local_sudo)
+@patch('confab.remote.run', local_sudo)
+@patch('confab.remote.put', local_put)
+class TestPush(TestCase):
+
+    def test_push_files(self):
+        """
+        Files are installed with their local modes, creating directories as needed.
+        """
+        with TempDir() as tmp_dir:
+            makedirs(join(tmp_dir.path, 'local'))
+            makedirs(join(tmp_dir.path, 'remote'))
+            write(join(tmp_dir.path, 'local/foo.conf'), 'foo')
+            write(join(tmp_dir.path, 'local/bar.sh'), 'bar')
+            chmod(join(tmp_dir.path, 'local/bar.sh'), 0755)
+            write(join(tmp_dir.path, 'remote/foo.conf'), 'old foo')
+
+            push_files([(join(tmp_dir.path, 'local/foo.conf'),
+                         join(tmp_dir.path, 'remote/foo.conf')),
+                        (join(tmp_dir.path, 'local/bar.sh'),
+                         join(tmp_dir.path, 'remote/bin/bar.sh'))])
+
+            eq_('foo', tmp_dir.read('remote/foo.conf'))
+            eq_('bar', tmp_dir.read('remote/bin/bar.sh'))
+            eq_(0755, stat(join(tmp_dir.path, 'remote/bin/bar.sh')).st_mode & 0777)
+            # no temporary files are left behind
+            eq_(['foo.conf'], [name for name in listdir(join(tmp_dir.path, 'remote'))
+                               if name.startswith('foo')])
+
+    def test_push_private_archive(self):
+        """
+        The archive is uploaded into a private directory, which is removed afterwards.
+        """
+        uploads = []
+
+        def put(local_path, remote_path, mode=None):
+            local_put(local_path, remote_path, mode)
+            uploads.append((remote_path,
+                            stat(dirname(remote_path)).st_mode & 0777,
+                            stat(remote_path).st_mode & 0777))
+
+        with TempDir() as tmp_dir:
+            write(join(tmp_dir.path, 'foo.conf'), 'secret')
+            with patch('confab.remote.put', put):
+                push_files([(join(tmp_dir.path, 'foo.conf'),
+                             join(tmp_dir.path, 'remote/foo.conf'))])
+
+        (remote_path, dir_mode, file_mode), = uploads
+        eq_(0700, dir_mode)
+        eq_(0600, file_mode)
+        ok_(not exists(dirname(remote_path)))
+
+    def test_push_failure(self):
+        """
+        A failure to install a file is reported.
+        """
+        with TempDir() as tmp_dir:
+            write(join(tmp_dir.path, 'foo.conf'), 'foo')
+            write(join(tmp_dir.path, 'file'), '')
+
+            with self.assertRaises(Exception):
+                push_files([(join(tmp_dir.path, 'foo.conf'),
+                             join(tmp_dir.path, 'file/foo.conf'))])
+            ok_(not exists(join(tmp_dir.path, 'file/foo.conf')))
+
+
+@patch('confab.remote.sudo', local_sudo)
+@patch('confab.remote.run', local_sudo)
+@patch('confab.remote.put', local_put)
+class TestDigests(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TempDir().__enter__()
+        self.templates_dir = join(self.tmp_dir.path, 'templates')
+        self.remote_dir = join(self.tmp_dir.path, 'remote')
+        self.role_dir = join(self.templates_dir, 'role', self.remote_dir[1:])
+        makedirs(self.role_dir)
+        makedirs(self.remote_dir)
+        for name in ['same.txt', 'changed.txt', 'missing.txt']:
+            write(join(self.role_dir, name), '{{foo}}')
+        write(join(self.remote_dir, 'same.txt'), 'foo\n')
+        write(join(self.remote_dir, 'changed.txt'), 'bar\n')
+
+        settings = Settings.load_from_dict(dict(environmentdefs={'any': ['host']},
+                                                roledefs={'role': ['host']}))
+        self.conffiles = ConfFiles(settings.for_env('any').all().next(),
+                                   FileSystemEnvironmentLoader(self.templates_dir),
+                                   lambda _: {'foo': 'foo'})
+
+    def tearDown(self):
+        self.tmp_dir.__exit__(None, None, None)
+
+    def remote_copy(self, name):
+        return self.tmp_dir.read(join('remotes/host', self.remote_dir[1:], name))
+
+    def test_digest_files(self):
+        """
+        Digests match those of the generated files.
+        """
+        digests = digest_files([conffile.remote for conffile in self.conffiles.conffiles])
+
+        eq_(2, len(digests))
+        for conffile in self.conffiles.conffiles:
+            if conffile.name.endswith('same.txt'):
+                eq_(conffile.hexdigest(), digests[conffile.remote])
+            elif conffile.name.endswith('changed.txt'):
+                ok_(conffile.hexdigest() != digests[conffile.remote])
+
+    def test_digest_escaped_names(self):
+        """
+        Digests are reported for file names that sha1sum would escape.
+        """
+        paths = [join(self.remote_dir, name) for name in ['a\\b.conf', 'a\nb.conf', 'missing']]
+        write(paths[0], 'foo\n')
+        write(paths[1], 'bar\n')
+
+        digests = digest_files(paths)
+
+        eq_(sha1('foo\n').hexdigest(), digests[paths[0]])
+        eq_(sha1('bar\n').hexdigest(), digests[paths[1]])
+        eq_(2, len(digests))
+
+    def test_diff(self):
+        """
+        Only changed files are pulled; identical files are copied locally.
+        """
+        with patch('confab.conffiles.pull_files', wraps=pull_files) as pull:
+            self.conffiles.diff(self.tmp_dir.path)
+
+        eq_([[join(self.remote_dir, 'changed.txt')]], [args[0] for args, _ in pull.call_args_list])
+        eq_('foo', self.remote_copy('same.txt'))
+        eq_('bar', self.remote_copy('changed.txt'))
+        with self.assertRaises(IOError):
+            self.remote_copy('missing.txt')
+
+    def test_diff_in_memory(self):
+        """
+        Diffs can be computed without writing generated or remote files.
+        """
+        output = StringIO()
+        with patch('sys.stdout', output):
+            with Options(diff_in_memory=True):
+                self.conffiles.diff(self.tmp_dir.path)
+
+        ok_(not exists(join(self.tmp_dir.path, 'generated')))
+        ok_(not exists(join(self.tmp_dir.path, 'remotes')))
+
+        lines = output.getvalue().splitlines()
+        ok_(any('-bar' in line for line in lines))
+        ok_(any('+foo' in line for line in lines))
+        ok_(any('Only in generated: {}'.format(join(self.remote_dir, 'missing.txt')) in line
+                for line in lines))
+        ok_(not any('same.txt' in line for line in lines))
+
+    def test_push(self):
+        """
+        Only changed and missing files are pushed, without pulling.
+        """
+        with patch('confab.conffiles.push_files', wraps=push_files) as push:
+            with patch('confab.conffiles.pull_files') as pull:
+                with Options(assume_yes=True):
+                    self.conffiles.push(self.tmp_dir.path)
+
+        ok_(not pull.called)
+        eq_(sorted([join(self.remote_dir, 'changed.txt'), join(self.remote_dir, 'missing.txt')]),
+            sorted(remote for _, remote in push.call_args[0][0]))
+        eq_('foo', self.tmp_dir.read('remote/changed.txt'))
+        eq_('foo', self.tmp_dir.read('remote/missing.txt'))
+
+    def test_without_digests(self):
+        """
+        Digest comparison can be disabled.
+        """
+        with patch('confab.conffiles.digest_files') as digest:
+            with Options(remote_digests=False):
+                self.conffiles.diff(self.tmp_dir.path)
+
+        ok_(not digest.called)
+        eq_('foo', self.remote_copy('same.txt'))
+        eq_('bar', self.remote_copy('changed.txt'))
+
+
+@patch('confab.remote.sudo', local_sudo)
+@patch('confab.remote.run', local_sudo)
+@patch('confab.remote.put', local_put)
+class TestGroupByHost(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TempDir().__enter__()
+        self.templates_dir = join(self.tmp_dir.path, 'templates')
+        self.remote_dir = join(self.tmp_dir.path, 'remote')
+        makedirs(self.remote_dir)
+        for role in ['role1', 'role2']:
+            makedirs(join(self.templates_dir, role, self.remote_dir[1:]))
+            write(join(self.templates_dir, role, self.remote_dir[1:], role + '.txt'), role)
+
+        self.settings = Settings.load_from_dict(dict(environmentdefs={'any': ['host']},
+                                                     roledefs={'role1': ['host'],
+                                                               'role2': ['host']}))
+
+    def tearDown(self):
+        self.tmp_dir.__exit__(None, None, None)
+
+    def make_conffiles(self):
+        return ConfFiles(self.settings.for_env('any').hosts().next(),
+                         FileSystemEnvironmentLoader(self.templates_dir),
+                         lambda _: {})
+
+    def test_push(self):
+        """
+        The files of all roles of a host are pushed at once.
+        """
+        conffiles = self.make_conffiles()
+        eq_(['role1', 'role2'], sorted(conffiles.role_names))
+
+        with patch('confab.conffiles.push_files', wraps=push_files) as push:
+            with Options(assume_yes=True):
+                conffiles.push(self.tmp_dir.path)
+
+        eq_(1, push.call_count)
+        eq_('role1', self.tmp_dir.read('remote/role1.txt'))
+        eq_('role2', self.tmp_dir.read('remote/role2.txt'))
+
+    def test_collision(self):
+        """
+        Roles of a host may not generate the same file.
+        """
+        write(join(self.templates_dir, 'role2', self.remote_dir[1:], 'role1.txt'), 'role2')
+        conffiles = self.make_conffiles()
+
+        with patch('confab.conffiles.push_files') as push:
+            with self.assertRaises(SystemExit):
+                with Options(assume_yes=True):
+                    conffiles.push(self.tmp_dir.path)
+        ok_(not push.called)
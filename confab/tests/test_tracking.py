@@ -0,0 +1,136 @@
+"""
+Tests for tracking the data keys templates read.
+"""
+from jinja2 import DictLoader, Environment, StrictUndefined, UndefinedError
+from mock import patch
+from nose.tools import eq_
+from os import makedirs
+from os.path import join
+from unittest import TestCase
+
+from confab.conffiles import ConfFiles
+from confab.definitions import Settings
+from confab.loaders import FileSystemEnvironmentLoader
+from confab.tests.utils import TempDir
+from confab.tracking import format_path, minimal_paths, render, track
+
+
+DATA = {
+    'value': 'foo',
+    'list': ['foo', 'bar'],
+    'dict': {
+        'value': 'foo',
+        'other': 'bar',
+        'nested': {'value': 'foo'},
+    },
+}
+
+
+class TestTracking(TestCase):
+
+    def setUp(self):
+        self.environment = Environment(undefined=StrictUndefined,
+                                       loader=DictLoader({'include': '{{ value }}'}))
+
+    def check(self, source, expected_keys, expected_output=None):
+        output, accessed = render(self.environment.from_string(source), DATA)
+        eq_(expected_keys, sorted(minimal_paths(accessed)))
+        if expected_output is not None:
+            eq_(expected_output, output)
+
+    def test_values(self):
+        """
+        Reading values records their paths, not the paths of enclosing dictionaries.
+        """
+        self.check('{{ value }} {{ dict.value }} {{ dict.nested.value }}',
+                   [('dict', 'nested', 'value'), ('dict', 'value'), ('value',)],
+                   'foo foo foo')
+
+    def test_iteration(self):
+        """
+        Iterating over a dictionary or list depends on all of it.
+        """
+        self.check('{% for key, value in dict.nested.items() %}{{ key }}{% endfor %}'
+                   '{% for value in list %}{{ value }}{% endfor %}',
+                   [('dict', 'nested'), ('list',)],
+                   'valuefoobar')
+
+    def test_membership(self):
+        """
+        Testing for keys depends on those keys, whether or not they exist.
+        """
+        self.check("{% if 'value' in dict %}{{ dict.get('missing', 'bar') }}{% endif %}",
+                   [('dict', 'missing'), ('dict', 'value')],
+                   'bar')
+
+    def test_globals(self):
+        """
+        Jinja globals are available but not tracked.
+        """
+        self.check('{{ range(2)|list }}', [], '[0, 1]')
+
+    def test_dict_methods(self):
+        """
+        Common dict methods are available.
+        """
+        self.check('{{ dict.nested.copy() }} {{ dict.has_key("value") }}',
+                   [('dict', 'nested'), ('dict', 'value')],
+                   "{'value': 'foo'} True")
+
+    def test_untrackable(self):
+        """
+        Templates that need actual dictionaries depend on all data.
+        """
+        template = self.environment.from_string('{{ dict.viewkeys()|sort|join(",") }}')
+        eq_('nested,other,value', template.render(DATA))
+        eq_(set([()]), track(template, DATA))
+
+    def test_include(self):
+        """
+        Including templates with context conservatively depends on all data.
+        """
+        self.check('{% include "include" %}', [()], 'foo')
+
+    def test_undefined(self):
+        """
+        Undefined values are still errors.
+        """
+        with self.assertRaises(UndefinedError):
+            render(self.environment.from_string('{{ missing }}'), DATA)
+
+    def test_format_path(self):
+        eq_('dict.nested.value', format_path(('dict', 'nested', 'value')))
+        eq_('*', format_path(()))
+
+
+class TestConfFileKeys(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TempDir().__enter__()
+        templates_dir = join(self.tmp_dir.path, 'templates', 'role')
+        makedirs(join(templates_dir, '{{ dict.value }}'))
+        with open(join(templates_dir, '{{ dict.value }}', 'file.txt'), 'w') as file_:
+            file_.write('{{ dict.nested.value }}')
+
+        self.settings = Settings.load_from_dict(dict(environmentdefs={'any': ['host']},
+                                                     roledefs={'role': ['host']}))
+        self.conffiles = ConfFiles(self.settings.for_env('any').all().next(),
+                                   FileSystemEnvironmentLoader(join(self.tmp_dir.path,
+                                                                    'templates')),
+                                   lambda _: DATA)
+
+    def tearDown(self):
+        self.tmp_dir.__exit__(None, None, None)
+
+    def test_data_keys(self):
+        """
+        Configuration files report the keys their name and content depend on.
+        """
+        conffile = self.conffiles.conffiles[0]
+
+        with patch('confab.conffiles.track', wraps=track) as track_:
+            eq_(frozenset([('dict', 'value'), ('dict', 'nested', 'value')]),
+                conffile.data_keys())
+        eq_(2, track_.call_count)
+        eq_('foo/file.txt', conffile.name)
+        eq_('foo\n', conffile.content())
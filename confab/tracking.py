@@ -0,0 +1,146 @@
+"""
+Tracking of the data keys that templates read.
+
+Templates are rendered against a view of their data that records the
+path of every key that is accessed. A recorded path means that the output
+depends on the value at that path (and everything below it); the empty
+path means that the template depends on all of its data, e.g. because
+it iterated over the top-level keys.
+
+The tracking view is not a ``dict``, so output rendered against it is only
+used to determine dependencies, never as the content of a file.
+"""
+import sys
+from collections import Mapping
+
+from jinja2.utils import concat
+
+
+class TrackingMapping(Mapping):
+    """
+    Read-only view of a mapping that records the paths of the keys read.
+
+    Nested mappings are wrapped in turn. Paths are only recorded for values
+    that are actually used: traversing a nested mapping to get to one of its
+    values records the path of that value, not of the mapping.
+    """
+
+    def __init__(self, data, accessed, path=(), fallback=None):
+        """
+        :param data: the mapping to track.
+        :param accessed: set to record the accessed paths (as tuples) in.
+        :param path: path of ``data`` in the top-level mapping.
+        :param fallback: untracked mapping for keys not in ``data``.
+        """
+        self._data = data
+        self._accessed = accessed
+        self._path = path
+        self._fallback = fallback or {}
+
+    def _record(self, path=()):
+        self._accessed.add(self._path + path)
+
+    def __getitem__(self, key):
+        if key not in self._data:
+            if key in self._fallback:
+                return self._fallback[key]
+            # the absence of a key matters too
+            self._record((key,))
+            raise KeyError(key)
+
+        value = self._data[key]
+        if isinstance(value, Mapping):
+            return TrackingMapping(value, self._accessed, self._path + (key,))
+
+        self._record((key,))
+        return value
+
+    def __contains__(self, key):
+        if key in self._data:
+            # the template context checks for top-level keys before reading
+            # them; only record the keys themselves once their values are used
+            if self._path or not isinstance(self._data[key], Mapping):
+                self._record((key,))
+            return True
+        if key in self._fallback:
+            return True
+        self._record((key,))
+        return False
+
+    def __iter__(self):
+        self._record()
+        return iter(self._data)
+
+    def __len__(self):
+        self._record()
+        return len(self._data)
+
+    def has_key(self, key):
+        return key in self
+
+    def copy(self):
+        self._record()
+        return dict(self._data)
+
+    def __eq__(self, other):
+        self._record()
+        if isinstance(other, TrackingMapping):
+            other._record()
+            other = other._data
+        return self._data == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        self._record()
+        return repr(self._data)
+
+    def __unicode__(self):
+        self._record()
+        return unicode(self._data)
+
+
+def render(template, data):
+    """
+    Render a Jinja2 template while tracking the data keys it reads.
+
+    Returns the rendered text and the set of accessed paths.
+    """
+    accessed = set()
+    context = template.new_context(TrackingMapping(data, accessed, fallback=template.globals),
+                                   shared=True)
+    try:
+        return concat(template.root_render_func(context)), accessed
+    except Exception:
+        exc_info = sys.exc_info()
+    return template.environment.handle_exception(exc_info, True)
+
+
+def track(template, data):
+    """
+    Return the set of data paths a Jinja2 template reads.
+
+    Templates that cannot be rendered against the tracking view (e.g. because
+    a filter requires an actual ``dict``) are assumed to depend on all data.
+    """
+    try:
+        return render(template, data)[1]
+    except Exception:
+        return set([()])
+
+
+def minimal_paths(paths):
+    """
+    Remove paths that are covered by a shorter path in the same set.
+    """
+    paths = set(paths)
+    return set(path for path in paths
+               if not any(path[:length] in paths for length in range(len(path))))
+
+
+def format_path(path):
+    """
+    Format a path as a dotted string; the empty path (all data) is ``*``.
+    """
+    return '.'.join(map(unicode, path)) if path else '*'
@@ -15,6 +15,19 @@ def assert_exists(*directories):
             abort('{} is not a valid directory'.format(directory))
 
 
+def assert_unique_paths(conffiles):
+    """
+    Assert that no two configuration files (e.g. of different roles) have the same path.
+    """
+    roles_by_path = {}
+    for conffile in conffiles:
+        roles = roles_by_path.setdefault(conffile.remote, [])
+        roles.append(conffile.role)
+        if len(roles) > 1:
+            abort('{path} is generated more than once for {host} (by roles {roles})'
+                  .format(path=conffile.remote, host=conffile.host, roles=', '.join(roles)))
+
+
 def assert_may_be_created(path):
     """
     Assert that path's directory either exists or can be created.